@@ -1,23 +1,31 @@
 """A Telegram bot to download YouTube videos as MP3 files."""
 
 import asyncio  # For rate limiting progress updates if needed
+import bisect
 import concurrent.futures
+import copy
 import logging
 import os
 import re
+import shutil
+import tempfile
+import threading
 import time
 from pathlib import Path
 
 import httpx
+import orjson
 import telegram
 import yt_dlp
 from dotenv import load_dotenv
+from yt_dlp.postprocessor import FFmpegMergerPP, FFmpegVideoRemuxerPP
 from pyrogram import Client as PyrogramClient
 from pyrogram.errors import (
     FloodWait,
 )  # For handling flood wait errors with Pyrogram
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import (
+    AIORateLimiter,
     ApplicationBuilder,
     CallbackQueryHandler,
     CommandHandler,
@@ -25,62 +33,289 @@ from telegram.ext import (
     MessageHandler,
     filters,
 )
+from telegram.request import HTTPXRequest
 
 # Load environment variables from .env file
 load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 API_ID = os.getenv("API_ID")
 API_HASH = os.getenv("API_HASH")
-
-# Enable logging - Set to DEBUG to capture more from yt-dlp
+# Public HTTPS base URL for webhook mode; long polling is used when unset
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PORT = int(os.getenv("PORT", "8443"))
+# Set YTDL_VERBOSE=1 to get yt-dlp's full debug output for downloads
+YTDL_VERBOSE = os.getenv("YTDL_VERBOSE") == "1"
+# Set YTTGBOT_DEBUG_TRACEBACKS=1 to log full tracebacks for failed downloads
+DEBUG_TRACEBACKS = os.getenv("YTTGBOT_DEBUG_TRACEBACKS") == "1"
+
+# Enable logging - Set LOG_LEVEL=DEBUG to capture more from yt-dlp
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.DEBUG,
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
 )
 logger = logging.getLogger(__name__)
-
-# Regex to find YouTube URLs (including Shorts)
-YOUTUBE_URL_REGEX = (
-    r"(?:https?:\/\/)?(?:www\.)?"
-    r"(?:youtube\.com\/(?:watch\?v=|shorts\/)|youtu\.be\/)([\w\-]+)"
+# httpx logs every Bot API request at INFO and Pyrogram its session chatter;
+# only their warnings are worth formatting and writing out
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("pyrogram").setLevel(logging.WARNING)
+
+# Pyrogram needs API_ID as an int: parsed once here, None if missing or
+# invalid (large files can't be sent via Pyrogram then)
+try:
+    API_ID_INT = int(API_ID) if API_ID else None
+except ValueError:
+    API_ID_INT = None
+    logger.error(f"Invalid API_ID: '{API_ID}'. Must be an integer.")
+
+# Regex to find YouTube URLs (including Shorts), compiled once at import
+YOUTUBE_URL_RE = re.compile(
+    r"(?:https?://)?(?:www\.)?"
+    r"(?:youtube\.com/(?:watch\?v=|shorts/)|youtu\.be/)([\w\-]+)"
 )
 
 # --- Configuration Constants ---
 MAX_CONCURRENT_DOWNLOADS = 5  # Max simultaneous downloads
+MAX_CONCURRENT_UPDATES = 8  # Max updates processed by handlers at once
+MAX_CONCURRENT_PROBES = 4  # Max simultaneous yt-dlp quality probes
 PENDING_URL_EXPIRY_SECONDS = 30 * 60  # 30 minutes
+MAX_PENDING_URLS = 4096  # Oldest pending URLs are dropped beyond this
 TEMP_FILE_MAX_AGE_SECONDS = 60 * 60  # 1 hour
 CLEANUP_INTERVAL_SECONDS = 10 * 60  # Run cleanup every 10 minutes
-TEMP_DIR = Path("temp_downloads")
+# Per-request download work directories live here. Point YTTGBOT_TEMP_DIR at
+# a tmpfs (e.g. /dev/shm) to keep transient downloads off the disk, given
+# enough RAM for the largest videos you expect. The bot works in its own
+# "yttgbot" subdirectory there, since the cleanup removes everything old in
+# TEMP_DIR and a shared directory holds other programs' files.
+TEMP_DIR = (
+    Path(os.environ["YTTGBOT_TEMP_DIR"]) / "yttgbot"
+    if os.getenv("YTTGBOT_TEMP_DIR")
+    else Path("temp_downloads")
+)
+AUDIO_CACHE_DIR = Path("audio_cache")  # Converted MP3s, one subdirectory per video
+AUDIO_CACHE_MAX_BYTES = 5 * 1024 * 1024 * 1024  # 5 GB
+
+# Upload progress edits happen only once all three thresholds are crossed
+PROGRESS_EDIT_MIN_BYTES = 5 * 1024 * 1024  # 5 MB uploaded since last edit
+PROGRESS_EDIT_MIN_PERCENT = 5  # 5 percentage points since last edit
+PROGRESS_EDIT_MIN_INTERVAL_SECONDS = 3.0
+# Bot-wide budget for progress edits (token bucket refilled at this rate), so
+# many parallel transfers can't crowd out replies under Telegram's ~30/s limit
+PROGRESS_EDITS_PER_SECOND = 10
+
+# yt-dlp errors after which the next download strategy is worth trying,
+# matched in one pass over the error message
+RETRYABLE_DOWNLOAD_ERROR_RE = re.compile(
+    "|".join(
+        re.escape(signature)
+        for signature in (
+            "Sign in to confirm you're not a bot",
+            "DPAPI",
+            "Failed to decrypt",
+            "failed to load cookies",
+            "could not find",
+            "Invalid po_token",
+            "Requested format is not available",
+            "Signature extraction failed",
+            "HTTP Error 403",
+            "forbidden",
+            "unable to download video data",
+        )
+    ),
+    re.IGNORECASE,
+)
+
+# Retry policy shared by audio and video downloads: back off exponentially
+# (capped) instead of re-requesting a throttled fragment right away, and
+# restart a download whose speed drops below YTDL_THROTTLED_RATE_LIMIT
+YTDL_RETRIES = 10
+YTDL_RETRY_SLEEP_FUNCTIONS = {
+    "fragment": lambda n: min(60, 0.25 * 1.5 ** n),
+    "http": lambda n: min(30, 2 ** n),
+}
+YTDL_THROTTLED_RATE_LIMIT = 100_000  # bytes/s
+
+# A download strategy that keeps failing with a strategy-specific problem is
+# skipped for a while instead of costing every request a failed attempt
+STRATEGY_FAILURE_THRESHOLD = 3  # Consecutive failures before skipping
+STRATEGY_COOLDOWN_SECONDS = 60  # How long a failing strategy is skipped
 
 # Server location for user-friendly geo-restriction messages
 SERVER_COUNTRY = "Germany"  # Update this if you move the server
 
+
+def firefox_cookies_available() -> bool:
+    """Return True if a Firefox profile with a cookie database exists on this host."""
+    home = Path.home()
+    profile_dirs = [
+        home / ".mozilla" / "firefox",  # Linux
+        home / "snap" / "firefox" / "common" / ".mozilla" / "firefox",  # Snap
+        home / "Library" / "Application Support" / "Firefox" / "Profiles",  # macOS
+    ]
+    if os.getenv("APPDATA"):  # Windows
+        profile_dirs.append(Path(os.environ["APPDATA"]) / "Mozilla" / "Firefox" / "Profiles")
+
+    return any(
+        any(profile_dir.glob("*/cookies.sqlite"))
+        for profile_dir in profile_dirs
+        if profile_dir.is_dir()
+    )
+
+
+# Probed once at startup. Download strategies list what they need under
+# "requires" and are skipped on hosts that lack it: e.g. without Firefox the
+# cookie strategy can only fail, after yt-dlp has searched the disk for a
+# profile on every request
+HOST_CAPABILITIES = {
+    name
+    for name, available in (
+        ("firefox_cookies", firefox_cookies_available()),
+    )
+    if available
+}
+
+# Resolved once instead of yt-dlp searching PATH for every download; None
+# leaves the lookup to yt-dlp
+FFMPEG_LOCATION = shutil.which("ffmpeg")
+
+# Firefox's cookies, exported as a Netscape cookie file so downloads don't
+# open and decrypt the browser's cookie database every time
+FIREFOX_COOKIE_JAR_PATH = Path("firefox_cookies.txt")
+
+
+def export_firefox_cookies() -> None:
+    """
+    Write Firefox's cookies to FIREFOX_COOKIE_JAR_PATH (blocking).
+    Adds the "firefox_cookie_jar" host capability once an export succeeded.
+    """
+    # Replace the jar atomically, downloads may be copying it right now
+    tmp_path = FIREFOX_COOKIE_JAR_PATH.with_suffix(".tmp")
+    try:
+        cookie_jar = yt_dlp.cookies.extract_cookies_from_browser("firefox")
+        # The cookies are decrypted session credentials: readable by the
+        # bot's user only (chmod too, in case a stale temp file exists)
+        fd = os.open(tmp_path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600)
+        os.chmod(tmp_path, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as tmp_file:
+            cookie_jar.save(tmp_file)
+        os.replace(tmp_path, FIREFOX_COOKIE_JAR_PATH)
+    except Exception as e:
+        logger.warning("Could not export Firefox cookies: %s", e)
+        return
+    HOST_CAPABILITIES.add("firefox_cookie_jar")
+
+
 # --- Global State ---
 # Semaphore to limit concurrent downloads
 download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
 
-# This dictionary will store the last update time for each chat_id to
-# limit edits.
-progress_message_last_edit_time = {}
+# Shared worker threads for blocking yt-dlp downloads, one per download slot
+download_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=MAX_CONCURRENT_DOWNLOADS, thread_name_prefix="ytdl"
+)
+
+# Separate, smaller pool for quality probes: they never take a download's
+# thread, and a burst of "Download Video" presses can't flood YouTube
+probe_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=MAX_CONCURRENT_PROBES, thread_name_prefix="ytdl-probe"
+)
 
 # Store pending video URLs for quality selection
-# Structure: {video_id: {"url": str, "timestamp": float, "chat_id": int}}
+# Structure: {video_id: {"url": str, "timestamp": float, "chat_id": int,
+#                       "qualities": list[dict] once fetched}}
 pending_video_urls = {}
 
 # Store active downloads/uploads that can be cancelled
-# Key: (chat_id, video_id), Value: {"cancelled": bool, "file_path": str or None}
+# Key: (chat_id, video_id),
+# Value: {"cancelled": bool, "file_path": str or None,
+#         "last_progress_bytes": int, "last_progress_percent": int,
+#         "last_progress_edit": float}
 active_operations = {}
 
+# Token bucket for PROGRESS_EDITS_PER_SECOND: tokens left and last refill time
+progress_edit_tokens = float(PROGRESS_EDITS_PER_SECOND)
+progress_edit_tokens_refilled = time.monotonic()
+
+# Progress edits running in the background, at most one per message
+# Key: (chat_id, message_id), Value: asyncio.Task
+progress_edit_tasks = {}
+
+# Video downloads shared by every request for the same video and quality
+# Key: (video_id, quality),
+# Value: {"future": asyncio.Future, "progress": DownloadProgress,
+#         "users": int (requests still using the download or its file)}
+video_downloads_in_flight = {}
+
+# Long-lived Pyrogram client for large uploads, started in post_init so the
+# MTProto handshake happens once per process instead of once per file.
+# If that start fails, the next upload retries it under the lock.
+pyrogram_app: PyrogramClient | None = None
+pyrogram_start_lock = asyncio.Lock()
+
+# Name of the audio download strategy that last succeeded; tried first on the
+# next download so a persistently failing strategy doesn't run every time
+last_successful_audio_strategy: str | None = None
+
+# Consecutive failures per audio download strategy
+# Key: strategy name, Value: (failure count, time.monotonic() of last failure)
+strategy_failures: dict[str, tuple[int, float]] = {}
+
+# One lock per video_id, so concurrent requests for the same video wait for
+# a single download and then take the result from the audio cache
+audio_download_locks: dict[str, asyncio.Lock] = {}
+
+# Cache stores run in worker threads, each under only its own video's lock;
+# this keeps two of them from evicting (and removing entries) at once
+audio_cache_eviction_lock = threading.Lock()
+
 
 # --- Utility Functions for Cleanup ---
 def ensure_temp_dir() -> None:
     """Create temp directory if it doesn't exist."""
-    TEMP_DIR.mkdir(exist_ok=True)
+    TEMP_DIR.mkdir(parents=True, exist_ok=True)
     logger.info(f"Temp directory ensured: {TEMP_DIR.absolute()}")
 
 
-def cleanup_old_temp_files() -> int:
-    """Remove temp files older than TEMP_FILE_MAX_AGE_SECONDS. Returns count of removed files."""
+def get_temp_entry_mtime(path: Path) -> float:
+    """
+    Return when a temp entry last changed. For a work directory that is the
+    newest mtime of the directory and its files: the directory's own mtime
+    stays put while yt-dlp appends to a .part file inside it.
+    """
+    mtime = path.stat().st_mtime
+    if path.is_dir():
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    mtime = max(mtime, entry.stat(follow_symlinks=False).st_mtime)
+                except FileNotFoundError:
+                    pass
+    return mtime
+
+
+def get_temp_dirs_in_use() -> frozenset[Path]:
+    """
+    Return the work directories of downloaded files that are still being sent
+    or shared, so the sweep leaves them alone however long an upload takes.
+    Call on the event loop, which owns both dicts.
+    """
+    in_use = {
+        Path(operation["file_path"]).parent
+        for operation in active_operations.values()
+        if operation.get("file_path")
+    }
+    for shared_download in video_downloads_in_flight.values():
+        future = shared_download["future"]
+        if future.done() and not future.cancelled() and future.exception() is None:
+            if future.result():
+                in_use.add(Path(future.result()).parent)
+    return frozenset(in_use)
+
+
+def cleanup_old_temp_files(in_use: frozenset[Path] = frozenset()) -> int:
+    """
+    Remove temp files and work directories older than TEMP_FILE_MAX_AGE_SECONDS,
+    except the directories in in_use. Returns count of removed entries.
+    """
     if not TEMP_DIR.exists():
         return 0
     
@@ -88,15 +323,23 @@ def cleanup_old_temp_files() -> int:
     current_time = time.time()
     
     for file_path in TEMP_DIR.iterdir():
-        if file_path.is_file():
-            file_age = current_time - file_path.stat().st_mtime
-            if file_age > TEMP_FILE_MAX_AGE_SECONDS:
-                try:
-                    file_path.unlink()
-                    logger.info(f"Cleaned up old temp file: {file_path.name} (age: {file_age/60:.1f} min)")
-                    removed_count += 1
-                except OSError as e:
-                    logger.warning(f"Failed to remove old temp file {file_path}: {e}")
+        if file_path in in_use:
+            continue
+        try:
+            file_age = current_time - get_temp_entry_mtime(file_path)
+            if file_age <= TEMP_FILE_MAX_AGE_SECONDS:
+                continue
+            if file_path.is_dir():
+                shutil.rmtree(file_path)
+            else:
+                file_path.unlink()
+            logger.info(f"Cleaned up old temp file: {file_path.name} (age: {file_age/60:.1f} min)")
+            removed_count += 1
+        except FileNotFoundError:
+            # Removed by its request while the sweep ran
+            continue
+        except OSError as e:
+            logger.warning(f"Failed to remove old temp file {file_path}: {e}")
     
     return removed_count
 
@@ -114,7 +357,7 @@ def cleanup_expired_pending_urls() -> int:
     
     for video_id in expired_keys:
         pending_video_urls.pop(video_id, None)
-        logger.debug(f"Cleaned up expired pending URL for video_id: {video_id}")
+        logger.debug("Cleaned up expired pending URL for video_id: %s", video_id)
     
     if expired_keys:
         logger.info(f"Cleaned up {len(expired_keys)} expired pending URLs")
@@ -127,8 +370,16 @@ async def periodic_cleanup_task() -> None:
     while True:
         await asyncio.sleep(CLEANUP_INTERVAL_SECONDS)
         try:
-            files_removed = cleanup_old_temp_files()
+            files_removed = await asyncio.to_thread(
+                cleanup_old_temp_files, get_temp_dirs_in_use()
+            )
             urls_removed = cleanup_expired_pending_urls()
+            for video_id, lock in list(audio_download_locks.items()):
+                if not lock.locked():
+                    audio_download_locks.pop(video_id, None)
+            # Pick up cookies Firefox refreshed since the last export
+            if "firefox_cookies" in HOST_CAPABILITIES:
+                await asyncio.to_thread(export_firefox_cookies)
             if files_removed or urls_removed:
                 logger.info(f"Periodic cleanup: {files_removed} files, {urls_removed} URLs removed")
         except Exception as e:
@@ -136,16 +387,17 @@ async def periodic_cleanup_task() -> None:
 
 
 # --- Simplified Inline Keyboard ---
-def get_info_inline_keyboard() -> InlineKeyboardMarkup:
-    """Return a simple inline keyboard with instructions to send a link."""
-    keyboard = [
+# Simple inline keyboard with instructions to send a link. It never changes,
+# so it is built once and shared by every reply.
+INFO_INLINE_KEYBOARD = InlineKeyboardMarkup(
+    [
         [
             InlineKeyboardButton(
                 "How to Send a Link", callback_data="show_link_instructions"
             )
         ]
     ]
-    return InlineKeyboardMarkup(keyboard)
+)
 
 
 def get_format_selection_keyboard(video_id: str) -> InlineKeyboardMarkup:
@@ -182,131 +434,185 @@ def get_cancel_keyboard(chat_id: int, video_id: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(keyboard)
 
 
-async def get_available_qualities(url: str) -> list[dict]:
-    """
-    Fetch available video qualities from YouTube.
-    Returns a list of dicts with format_id, height, and label.
-    Uses YouTube's format_note (like "1440p") for accurate labeling.
-    """
-    # Try different player clients that work without authentication
-    ydl_opts_list = [
-        {
-            "quiet": True,
-            "no_warnings": True,
-            "extract_flat": False,
-            "extractor_args": {
-                "youtube": {"player_client": ["ios", "web"]}
-            },
-        },
-        {
-            "quiet": True,
-            "no_warnings": True,
-            "extract_flat": False,
-            "extractor_args": {
-                "youtube": {"player_client": ["android_creator", "web"]}
-            },
+# yt-dlp options for the quality probes, tried in order.
+# Different player clients that work without authentication.
+# The menu only needs the formats' heights from the player response, so the
+# probes skip the watch page and the HLS/DASH manifests, which only add
+# request round-trips (downloads still fetch everything they need).
+QUALITY_PROBE_YDL_OPTS = (
+    {
+        "quiet": True,
+        "no_warnings": True,
+        "extract_flat": False,
+        "extractor_args": {
+            "youtube": {
+                "player_client": ["ios", "web"],
+                "player_skip": ["webpage"],
+                "skip": ["hls", "dash"],
+            }
         },
-        {
-            "quiet": True,
-            "no_warnings": True,
-            "extract_flat": False,
+    },
+    {
+        "quiet": True,
+        "no_warnings": True,
+        "extract_flat": False,
+        "extractor_args": {
+            "youtube": {
+                "player_client": ["android_creator", "web"],
+                "player_skip": ["webpage"],
+                "skip": ["hls", "dash"],
+            }
         },
-    ]
+    },
+    {
+        "quiet": True,
+        "no_warnings": True,
+        "extract_flat": False,
+        # Last resort keeps yt-dlp's default clients and watch page fetch
+        "extractor_args": {"youtube": {"skip": ["hls", "dash"]}},
+    },
+)
 
-    for ydl_opts in ydl_opts_list:
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                if not info:
-                    continue
+# YoutubeDL instances for the probes, one set per worker thread (YoutubeDL
+# isn't thread-safe). Reusing them keeps the extractors' in-memory player
+# and signature caches warm instead of rebuilding them for every link.
+ytdl_probe_instances = threading.local()
+
+
+def run_ytdl_extract_info(probe_index: int, url: str) -> dict | None:
+    """Fetch video metadata with the given quality probe, without downloading (blocking)."""
+    instances = getattr(ytdl_probe_instances, "by_index", None)
+    if instances is None:
+        instances = ytdl_probe_instances.by_index = {}
+    ydl = instances.get(probe_index)
+    if ydl is None:
+        ydl = instances[probe_index] = yt_dlp.YoutubeDL(
+            QUALITY_PROBE_YDL_OPTS[probe_index]
+        )
+    return ydl.extract_info(url, download=False)
 
-                formats = info.get("formats", [])
-                available_qualities = []
-                seen_labels = set()
-
-                # Get all video formats with height info
-                video_formats = [
-                    f for f in formats
-                    if f.get("vcodec") != "none" and f.get("height")
-                ]
-                video_formats.sort(key=lambda x: x.get("height", 0), reverse=True)
-
-                # Use YouTube's format_note for accurate quality labels
-                # YouTube provides format_note like "1440p", "1080p", "720p" etc.
-                # which correctly represents the intended quality regardless of
-                # actual pixel dimensions (which vary with aspect ratio)
-                for fmt in video_formats:
-                    height = fmt.get("height")
-                    format_note = fmt.get("format_note", "")
-                    format_id = fmt.get("format_id", "")
-
-                    if height:
-                        # Try to get the quality label from format_note first
-                        # Format notes like "1440p60 HDR", "1080p", "720p60" etc.
-                        label = None
-                        if format_note:
-                            # Extract the resolution part (e.g., "1440p" from "1440p60 HDR")
-                            import re
-                            match = re.match(r"(\d+)p", format_note)
-                            if match:
-                                quality_num = int(match.group(1))
-                                if quality_num >= 2160:
-                                    label = "2160p 4K"
-                                elif quality_num >= 1440:
-                                    label = "1440p 2K"
-                                elif quality_num >= 1080:
-                                    label = "1080p HD"
-                                elif quality_num >= 720:
-                                    label = "720p HD"
-                                elif quality_num >= 480:
-                                    label = "480p"
-                                elif quality_num >= 360:
-                                    label = "360p"
-                                elif quality_num >= 240:
-                                    label = "240p"
-                                else:
-                                    label = "144p"
-
-                        # Fallback to height-based labeling if format_note unavailable
-                        if not label:
-                            if height >= 2160:
-                                label = "2160p 4K"
-                            elif height >= 1440:
-                                label = "1440p 2K"
-                            elif height >= 1080:
-                                label = "1080p HD"
-                            elif height >= 720:
-                                label = "720p HD"
-                            elif height >= 480:
-                                label = "480p"
-                            elif height >= 360:
-                                label = "360p"
-                            elif height >= 240:
-                                label = "240p"
-                            else:
-                                label = "144p"
-
-                        if label not in seen_labels:
-                            seen_labels.add(label)
-                            available_qualities.append({
-                                "format_id": format_id,  # Store format_id for precise selection
-                                "height": height,
-                                "label": label,
-                            })
-
-                # Sort by height descending
-                available_qualities.sort(key=lambda x: x["height"], reverse=True)
-
-                if available_qualities:
-                    logger.info(f"Found {len(available_qualities)} quality options for {url}")
-                    for q in available_qualities:
-                        logger.info(f"  - {q['label']} (height={q['height']}, format_id={q['format_id']})")
-                    return available_qualities
 
-        except Exception as e:
-            logger.warning(f"Error fetching qualities with strategy: {e}")
+# Quality labels and the minimum resolution for each (after the first)
+QUALITY_LABELS = (
+    "144p", "240p", "360p", "480p", "720p HD", "1080p HD", "1440p 2K", "2160p 4K"
+)
+QUALITY_LABEL_MIN_RESOLUTIONS = (240, 360, 480, 720, 1080, 1440, 2160)
+FORMAT_NOTE_RESOLUTION_RE = re.compile(r"(\d+)p")
+
+# Bulky parts of a probe's info dict that the video download doesn't use;
+# captions alone carry URLs for ~150 languages. Dropped before the dict is
+# kept in pending_video_urls, where it can sit for PENDING_URL_EXPIRY_SECONDS.
+PROBE_INFO_UNUSED_KEYS = frozenset({
+    "automatic_captions",
+    "subtitles",
+    "requested_subtitles",
+    "thumbnails",
+    "heatmap",
+    "chapters",
+    "description",
+    "tags",
+    "categories",
+})
+
+
+def get_quality_label(resolution: int) -> str:
+    """Return the menu label for a resolution, e.g. 1080 -> "1080p HD"."""
+    return QUALITY_LABELS[bisect.bisect_right(QUALITY_LABEL_MIN_RESOLUTIONS, resolution)]
+
+
+def probe_available_qualities(probe_index: int, url: str) -> tuple[list[dict], dict | None]:
+    """
+    Run one quality probe and list the video qualities it found (blocking).
+    Returns the qualities and the extracted info, or ([], None) if the probe fails.
+    """
+    try:
+        info = run_ytdl_extract_info(probe_index, url)
+    except Exception as e:
+        logger.warning(f"Error fetching qualities with strategy: {e}")
+        return [], None
+    if not info:
+        return [], None
+
+    # One pass over the formats keeps the tallest video format per quality
+    # label (the first one listed on ties); no sorting of all formats needed
+    best_by_label = {}
+
+    # Use YouTube's format_note for accurate quality labels
+    # YouTube provides format_note like "1440p", "1080p", "720p" etc.
+    # which correctly represents the intended quality regardless of
+    # actual pixel dimensions (which vary with aspect ratio)
+    for fmt in info.get("formats", []):
+        height = fmt.get("height")
+        # Only video formats with height info
+        if not height or fmt.get("vcodec") == "none":
             continue
 
+        # Try to get the quality label from format_note first
+        # Format notes like "1440p60 HDR", "1080p", "720p60" etc.
+        # Extract the resolution part (e.g., "1440p" from "1440p60 HDR"),
+        # falling back to height-based labeling if it's unavailable
+        format_note = fmt.get("format_note", "")
+        match = FORMAT_NOTE_RESOLUTION_RE.match(format_note) if format_note else None
+        label = get_quality_label(int(match.group(1)) if match else height)
+
+        best = best_by_label.get(label)
+        if best is None or height > best["height"]:
+            best_by_label[label] = {
+                "format_id": fmt.get("format_id", ""),  # Store format_id for precise selection
+                "height": height,
+                "label": label,
+            }
+
+    # Sort the few labels found by height descending
+    return sorted(best_by_label.values(), key=lambda x: x["height"], reverse=True), info
+
+
+async def get_available_qualities(url: str, video_id: str) -> list[dict]:
+    """
+    Fetch available video qualities from YouTube.
+    Returns a list of dicts with format_id, height, and label.
+    Uses YouTube's format_note (like "1440p") for accurate labeling.
+    Results are kept in the video's pending_video_urls entry, so going back
+    to the format menu and choosing video again doesn't re-extract them.
+    The probe's info dict is kept there too, for download_youtube_video.
+    """
+    url_data = pending_video_urls.get(video_id)
+    if url_data and "qualities" in url_data:
+        return url_data["qualities"]
+
+    # Metadata extraction does blocking network I/O for seconds, so the
+    # probes run in worker threads, all at once: the first to find qualities
+    # wins and a failing player client no longer delays the others
+    loop = asyncio.get_running_loop()
+    probes = [
+        loop.run_in_executor(
+            probe_executor, probe_available_qualities, probe_index, url
+        )
+        for probe_index in range(len(QUALITY_PROBE_YDL_OPTS))
+    ]
+    try:
+        for probe in asyncio.as_completed(probes):
+            available_qualities, info = await probe
+            if available_qualities:
+                logger.info(f"Found {len(available_qualities)} quality options for {url}")
+                for q in available_qualities:
+                    logger.info(f"  - {q['label']} (height={q['height']}, format_id={q['format_id']})")
+                # Re-read the entry: it may have expired or been cancelled
+                # while the probes ran
+                url_data = pending_video_urls.get(video_id)
+                if url_data:
+                    url_data["qualities"] = available_qualities
+                    url_data["info"] = {
+                        key: value for key, value in info.items()
+                        if key not in PROBE_INFO_UNUSED_KEYS
+                    }
+                return available_qualities
+    finally:
+        # Probes still queued are dropped; running ones finish in the
+        # background and their results are ignored
+        for probe in probes:
+            probe.cancel()
+
     # If all methods fail, return common quality options
     # The download function will handle getting the closest available quality
     logger.warning(f"Using default quality options for {url}")
@@ -388,11 +694,64 @@ def ytdl_progress_hook(d):
         actual_ext = d.get("info_dict", {}).get("ext")
         logger.info(
             "yt-dlp hook: Finished processing. Expected final file: "
-            f"{final_filename}, Actual format/ext reported by yt-dlp: "
-            f"{actual_ext}"
+            "%s, Actual format/ext reported by yt-dlp: %s",
+            final_filename,
+            actual_ext,
         )
     elif d["status"] == "error":
-        logger.error(f"yt-dlp hook: Error. Data: {d}")
+        logger.error("yt-dlp hook: Error. Data: %s", d)
+
+
+def is_message_not_modified(error: telegram.error.TelegramError) -> bool:
+    """Return True if Telegram rejected an edit because nothing changed."""
+    # Telegram's wording ("Message is not modified: ...") is stable, so a
+    # plain substring test on the message avoids lowercasing a copy of it
+    return "not modified" in error.message
+
+
+async def send_final_status(
+    context: ContextTypes.DEFAULT_TYPE,
+    chat_id: int,
+    processing_message,
+    text: str,
+    **kwargs,
+) -> None:
+    """
+    Show a final status with the info keyboard in one API call: by editing the
+    processing message in place, or as a new message if it can't be edited.
+    Extra keyword arguments (e.g. parse_mode) are passed to either call.
+    """
+    if processing_message:
+        await wait_for_progress_edit(chat_id, processing_message.message_id)
+        try:
+            await processing_message.edit_text(
+                text, reply_markup=INFO_INLINE_KEYBOARD, **kwargs
+            )
+            return
+        except telegram.error.TelegramError as e:
+            logger.debug("Could not edit processing message, sending new one: %s", e)
+    await context.bot.send_message(
+        chat_id=chat_id,
+        text=text,
+        reply_markup=INFO_INLINE_KEYBOARD,
+        **kwargs,
+    )
+
+
+async def edit_query_message(query, text: str, reply_markup=None, **kwargs) -> None:
+    """
+    Edit the message a callback query came from, unless it already shows this
+    text and keyboard (e.g. the same button tapped twice), which would only
+    cost a round-trip for Telegram's "message is not modified" error.
+    Markdown is stripped from message.text, so only plain texts can match.
+    """
+    message = query.message
+    if (
+        getattr(message, "text", None) == text
+        and getattr(message, "reply_markup", None) == reply_markup
+    ):
+        return
+    await query.edit_message_text(text, reply_markup=reply_markup, **kwargs)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -405,7 +764,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "Hi! I can download YouTube videos as **audio (MP3)** or **video** files.\n\n"
         "Simply paste a YouTube video link and send it to me!",
         parse_mode="Markdown",
-        reply_markup=get_info_inline_keyboard(),  # Show the single button
+        reply_markup=INFO_INLINE_KEYBOARD,  # Show the single button
     )
 
 
@@ -414,239 +773,220 @@ async def button_callback_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
     """Handle button presses from the inline keyboard."""
-    # Direct print for immediate feedback
-    print("BUTTON_CALLBACK_HANDLER_ENTERED_VIA_PRINT")
-    logger.info("--- button_callback_handler: Entered function VIA LOGGER ---")
+    logger.debug("button_callback_handler: entered")
     query = update.callback_query
 
     if not query:
-        print("BUTTON_CALLBACK_HANDLER_QUERY_IS_NONE_VIA_PRINT")
         logger.error("button_callback_handler: query object is None.")
         return
 
-    print(
-        "BUTTON_CALLBACK_HANDLER_QUERY_OBJECT_VALID_VIA_PRINT: "
-        f"id={query.id}, data={query.data}"
-    )
     logger.debug(
-        f"button_callback_handler: query object found: id={query.id}, "
-        f"data={query.data}"
+        "button_callback_handler: query object found: id=%s, data=%s",
+        query.id, query.data,
     )
 
     try:
-        print(
-            "BUTTON_CALLBACK_HANDLER_ATTEMPTING_ANSWER_VIA_PRINT: "
-            f"data={query.data}"
-        )
-        logger.info(
-            "button_callback_handler: Attempting to answer query ID: "
-            f"{query.id} with data: {query.data}"
-        )
         await query.answer()  # Acknowledge the button press
-        print(
-            f"BUTTON_CALLBACK_HANDLER_ANSWERED_QUERY_VIA_PRINT: "
-            f"data={query.data}"
-        )
-        logger.info(
-            "button_callback_handler: Successfully answered query ID: "
-            f"{query.id} with data: {query.data}"
+        logger.debug(
+            "button_callback_handler: answered query ID %s with data: %s",
+            query.id, query.data,
         )
 
-        if query.data == "show_link_instructions":
-            print("BUTTON_CALLBACK_HANDLER_IF_BRANCH_ENTERED_VIA_PRINT")
-            logger.info("'show_link_instructions' button pressed.")
-            instruction_text = (
-                "To send a link: Just copy the full YouTube video URL "
-                "(e.g., from your browser or the YouTube app) and paste "
-                "it directly into our chat, then send it as a message."
-            )
-            try:
-                await query.edit_message_text(
-                    text=instruction_text,
-                    reply_markup=get_info_inline_keyboard(),
+        # callback_data is "<action>" or "<action>:<args>"; parse it once
+        action, _, payload = query.data.partition(":")
+        match action:
+            case "show_link_instructions":
+                logger.info("'show_link_instructions' button pressed.")
+                instruction_text = (
+                    "To send a link: Just copy the full YouTube video URL "
+                    "(e.g., from your browser or the YouTube app) and paste "
+                    "it directly into our chat, then send it as a message."
                 )
-                msg_id = query.message.message_id if query.message else "N/A"
-                logger.info(f"Edited message {msg_id} with instructions.")
-            except telegram.error.BadRequest as e_edit:
-                if "message is not modified" in str(e_edit).lower():
-                    msg_id = (
-                        query.message.message_id if query.message else "N/A"
-                    )
-                    logger.debug(
-                        f"Instruction message {msg_id} already shown."
-                    )
-                else:
-                    msg_id = (
-                        query.message.message_id if query.message else "N/A"
+                try:
+                    await edit_query_message(
+                        query, instruction_text, reply_markup=INFO_INLINE_KEYBOARD
                     )
+                    msg_id = query.message.message_id if query.message else "N/A"
+                    logger.info(f"Edited message {msg_id} with instructions.")
+                except telegram.error.BadRequest as e_edit:
+                    if is_message_not_modified(e_edit):
+                        msg_id = (
+                            query.message.message_id if query.message else "N/A"
+                        )
+                        logger.debug(
+                            f"Instruction message {msg_id} already shown."
+                        )
+                    else:
+                        msg_id = (
+                            query.message.message_id if query.message else "N/A"
+                        )
+                        logger.error(
+                            f"Failed to edit message {msg_id} for instructions: "
+                            f"{e_edit}. Sending new message."
+                        )
+                        await context.bot.send_message(
+                            chat_id=query.message.chat_id,
+                            text=instruction_text,
+                            reply_markup=INFO_INLINE_KEYBOARD,
+                        )
+                except Exception as e_edit_generic:
+                    msg_id = query.message.message_id if query.message else "N/A"
                     logger.error(
-                        f"Failed to edit message {msg_id} for instructions: "
-                        f"{e_edit}. Sending new message."
+                        f"Generic error editing message {msg_id} for "
+                        f"instructions: {e_edit_generic}. Sending new."
                     )
                     await context.bot.send_message(
                         chat_id=query.message.chat_id,
                         text=instruction_text,
-                        reply_markup=get_info_inline_keyboard(),
+                        reply_markup=INFO_INLINE_KEYBOARD,
                     )
-            except Exception as e_edit_generic:
-                msg_id = query.message.message_id if query.message else "N/A"
-                logger.error(
-                    f"Generic error editing message {msg_id} for "
-                    f"instructions: {e_edit_generic}. Sending new."
-                )
-                await context.bot.send_message(
-                    chat_id=query.message.chat_id,
-                    text=instruction_text,
-                    reply_markup=get_info_inline_keyboard(),
-                )
-        
-        # Handle audio download request
-        elif query.data.startswith("download_audio:"):
-            video_id = query.data.split(":")[1]
-            url_data = pending_video_urls.get(video_id)
-            youtube_url = url_data["url"] if url_data else None
-            
-            if not youtube_url:
-                await query.edit_message_text(
-                    "Session expired. Please send the YouTube link again."
-                )
-                return
-            
-            chat_id = query.message.chat_id
-            logger.info(f"Audio download requested for video_id: {video_id}")
 
-            # Clean up pending URL first
-            pending_video_urls.pop(video_id, None)
+            # Handle audio download request
+            case "download_audio":
+                video_id = payload
+                url_data = pending_video_urls.get(video_id)
+                youtube_url = url_data["url"] if url_data else None
+
+                if not youtube_url:
+                    await edit_query_message(
+                        query, "Session expired. Please send the YouTube link again."
+                    )
+                    return
+
+                chat_id = query.message.chat_id
+                logger.info(f"Audio download requested for video_id: {video_id}")
+
+                # Clean up pending URL first
+                pending_video_urls.pop(video_id, None)
+
+                # Process audio download as a background task so cancel button can work
+                asyncio.create_task(process_audio_download(
+                    chat_id, video_id, youtube_url, context, query
+                ))
+
+            # Handle video download request - show quality selection
+            case "download_video":
+                video_id = payload
+                url_data = pending_video_urls.get(video_id)
+                youtube_url = url_data["url"] if url_data else None
+
+                if not youtube_url:
+                    await edit_query_message(
+                        query, "Session expired. Please send the YouTube link again."
+                    )
+                    return
+
+                logger.info(f"Video download requested for video_id: {video_id}")
+
+                # Show loading message while fetching qualities
+                await query.edit_message_text("Fetching available qualities...")
+
+                # Get available qualities
+                qualities = await get_available_qualities(youtube_url, video_id)
+
+                if qualities:
+                    await query.edit_message_text(
+                        "**Select Video Quality:**",
+                        parse_mode="Markdown",
+                        reply_markup=get_video_quality_keyboard(video_id, qualities),
+                    )
+                else:
+                    # Fallback to default qualities if fetch fails
+                    default_qualities = [
+                        {"height": 720, "label": "720p HD"},
+                        {"height": 480, "label": "480p"},
+                        {"height": 360, "label": "360p"},
+                    ]
+                    await query.edit_message_text(
+                        "**Select Video Quality:**\n_(Couldn't detect available qualities)_",
+                        parse_mode="Markdown",
+                        reply_markup=get_video_quality_keyboard(video_id, default_qualities),
+                    )
+
+            # Handle quality selection
+            case "quality":
+                video_id, _, quality_str = payload.partition(":")
+                quality = int(quality_str)  # Quality designation (e.g., 1440, 1080), not pixel height
+                url_data = pending_video_urls.get(video_id)
+                youtube_url = url_data["url"] if url_data else None
+
+                if not youtube_url:
+                    await edit_query_message(
+                        query, "Session expired. Please send the YouTube link again."
+                    )
+                    return
+
+                chat_id = query.message.chat_id
+                logger.info(f"Video download at {quality}p requested for video_id: {video_id}")
+
+                # Clean up pending URL first, keeping the quality probe's info
+                # for the download
+                probe_info = url_data.get("info")
+                pending_video_urls.pop(video_id, None)
+
+                # Process video download as a background task so cancel button can work
+                asyncio.create_task(process_video_download(
+                    chat_id, video_id, youtube_url, quality, context, query,
+                    probe_info,
+                ))
+
+            # Handle back button
+            case "back_to_format":
+                video_id = payload
+
+                if video_id not in pending_video_urls:
+                    await edit_query_message(
+                        query, "Session expired. Please send the YouTube link again."
+                    )
+                    return
 
-            # Process audio download as a background task so cancel button can work
-            asyncio.create_task(process_audio_download(
-                chat_id, video_id, youtube_url, context, query
-            ))
-        
-        # Handle video download request - show quality selection
-        elif query.data.startswith("download_video:"):
-            video_id = query.data.split(":")[1]
-            url_data = pending_video_urls.get(video_id)
-            youtube_url = url_data["url"] if url_data else None
-            
-            if not youtube_url:
-                await query.edit_message_text(
-                    "Session expired. Please send the YouTube link again."
-                )
-                return
-            
-            logger.info(f"Video download requested for video_id: {video_id}")
-            
-            # Show loading message while fetching qualities
-            await query.edit_message_text("Fetching available qualities...")
-            
-            # Get available qualities
-            qualities = await get_available_qualities(youtube_url)
-            
-            if qualities:
-                await query.edit_message_text(
-                    "**Select Video Quality:**",
-                    parse_mode="Markdown",
-                    reply_markup=get_video_quality_keyboard(video_id, qualities),
-                )
-            else:
-                # Fallback to default qualities if fetch fails
-                default_qualities = [
-                    {"height": 720, "label": "720p HD"},
-                    {"height": 480, "label": "480p"},
-                    {"height": 360, "label": "360p"},
-                ]
                 await query.edit_message_text(
-                    "**Select Video Quality:**\n_(Couldn't detect available qualities)_",
+                    "**YouTube Link Detected!**\n\n"
+                    "Choose download format:",
                     parse_mode="Markdown",
-                    reply_markup=get_video_quality_keyboard(video_id, default_qualities),
+                    reply_markup=get_format_selection_keyboard(video_id),
                 )
-        
-        # Handle quality selection
-        elif query.data.startswith("quality:"):
-            parts = query.data.split(":")
-            video_id = parts[1]
-            quality = int(parts[2])  # Quality designation (e.g., 1440, 1080), not pixel height
-            url_data = pending_video_urls.get(video_id)
-            youtube_url = url_data["url"] if url_data else None
-
-            if not youtube_url:
-                await query.edit_message_text(
-                    "Session expired. Please send the YouTube link again."
-                )
-                return
 
-            chat_id = query.message.chat_id
-            logger.info(f"Video download at {quality}p requested for video_id: {video_id}")
+            # Handle cancel button (for format selection menu)
+            case "cancel":
+                video_id = payload
 
-            # Clean up pending URL first
-            pending_video_urls.pop(video_id, None)
+                # Clean up pending URL
+                pending_video_urls.pop(video_id, None)
 
-            # Process video download as a background task so cancel button can work
-            asyncio.create_task(process_video_download(
-                chat_id, video_id, youtube_url, quality, context, query
-            ))
-        
-        # Handle back button
-        elif query.data.startswith("back_to_format:"):
-            video_id = query.data.split(":")[1]
-            
-            if video_id not in pending_video_urls:
+                # Show the welcome/start menu
                 await query.edit_message_text(
-                    "Session expired. Please send the YouTube link again."
+                    "Hi! I can download YouTube videos as **audio (MP3)** or **video** files.\n\n"
+                    "Simply paste a YouTube video link and send it to me!",
+                    parse_mode="Markdown",
+                    reply_markup=INFO_INLINE_KEYBOARD,
                 )
-                return
-            
-            await query.edit_message_text(
-                "**YouTube Link Detected!**\n\n"
-                "Choose download format:",
-                parse_mode="Markdown",
-                reply_markup=get_format_selection_keyboard(video_id),
-            )
-        
-        # Handle cancel button (for format selection menu)
-        elif query.data.startswith("cancel:"):
-            video_id = query.data.split(":")[1]
-
-            # Clean up pending URL
-            pending_video_urls.pop(video_id, None)
-
-            # Show the welcome/start menu
-            await query.edit_message_text(
-                "Hi! I can download YouTube videos as **audio (MP3)** or **video** files.\n\n"
-                "Simply paste a YouTube video link and send it to me!",
-                parse_mode="Markdown",
-                reply_markup=get_info_inline_keyboard(),
-            )
 
-        # Handle cancel operation (for ongoing downloads/uploads)
-        elif query.data.startswith("cancel_operation:"):
-            parts = query.data.split(":")
-            cancel_chat_id = int(parts[1])
-            cancel_video_id = parts[2] if len(parts) > 2 else None
-            
-            # Use composite key (chat_id, video_id)
-            operation_key = (cancel_chat_id, cancel_video_id)
+            # Handle cancel operation (for ongoing downloads/uploads)
+            case "cancel_operation":
+                chat_id_str, _, cancel_video_id = payload.partition(":")
+                cancel_chat_id = int(chat_id_str)
+                cancel_video_id = cancel_video_id or None
 
-            if operation_key in active_operations:
-                active_operations[operation_key]["cancelled"] = True
-                logger.info(f"Cancel requested for chat_id: {cancel_chat_id}, video_id: {cancel_video_id}")
+                # Use composite key (chat_id, video_id)
+                operation_key = (cancel_chat_id, cancel_video_id)
 
-                await query.edit_message_text(
-                    "Cancelling... Please wait.",
-                )
-            else:
-                keys_str = str(list(active_operations.keys()))
-                await query.edit_message_text(
-                    f"No active operation to cancel. Active: {keys_str}",
-                    reply_markup=get_info_inline_keyboard(),
-                )
+                if operation_key in active_operations:
+                    active_operations[operation_key]["cancelled"] = True
+                    logger.info(f"Cancel requested for chat_id: {cancel_chat_id}, video_id: {cancel_video_id}")
 
-        else:
-            logger.warning(f"Unknown callback_data received: '{query.data}'")
+                    await edit_query_message(query, "Cancelling... Please wait.")
+                else:
+                    keys_str = str(list(active_operations.keys()))
+                    await query.edit_message_text(
+                        f"No active operation to cancel. Active: {keys_str}",
+                        reply_markup=INFO_INLINE_KEYBOARD,
+                    )
+
+            case _:
+                logger.warning(f"Unknown callback_data received: '{query.data}'")
 
     except Exception as e_main_cb:
-        print(f"BUTTON_CALLBACK_HANDLER_ERROR_VIA_PRINT: {e_main_cb}")
         logger.error(
             f"Error in button_callback_handler: {e_main_cb}", exc_info=True
         )
@@ -663,51 +1003,170 @@ async def button_callback_handler(
                 pass
 
 
+def take_progress_edit_token(now: float) -> bool:
+    """
+    Take one progress edit from the bot-wide budget, or return False if it's
+    used up. Progress edits are optional, so they are skipped, not queued.
+    """
+    global progress_edit_tokens, progress_edit_tokens_refilled
+
+    progress_edit_tokens = min(
+        PROGRESS_EDITS_PER_SECOND,
+        progress_edit_tokens
+        + (now - progress_edit_tokens_refilled) * PROGRESS_EDITS_PER_SECOND,
+    )
+    progress_edit_tokens_refilled = now
+    if progress_edit_tokens < 1:
+        return False
+    progress_edit_tokens -= 1
+    return True
+
+
+def should_edit_progress(operation: dict, current: int, percentage: int) -> bool:
+    """
+    Return True if the progress message of an operation may be edited now.
+
+    Pyrogram calls its progress callback for every uploaded chunk, so edits
+    are coalesced until enough bytes, percent and time have passed since the
+    previous edit (on top of the bot-wide AIORateLimiter).
+    """
+    now = time.monotonic()
+    if (
+        current - operation.get("last_progress_bytes", 0) < PROGRESS_EDIT_MIN_BYTES
+        or percentage - operation.get("last_progress_percent", 0) < PROGRESS_EDIT_MIN_PERCENT
+        or now - operation.get("last_progress_edit", 0) < PROGRESS_EDIT_MIN_INTERVAL_SECONDS
+        or not take_progress_edit_token(now)
+    ):
+        return False
+
+    operation["last_progress_bytes"] = current
+    operation["last_progress_percent"] = percentage
+    operation["last_progress_edit"] = now
+    return True
+
+
+def start_progress_edit(bot, chat_id: int, message_id: int, text: str, reply_markup) -> None:
+    """
+    Edit a progress message in a background task, so the caller never waits
+    for it. Pyrogram awaits its progress callback between chunks, so an edit
+    held up by the rate limiter would otherwise stall the upload itself.
+    """
+    key = (chat_id, message_id)
+    task = asyncio.create_task(
+        edit_progress_message(bot, chat_id, message_id, text, reply_markup)
+    )
+    progress_edit_tasks[key] = task
+    task.add_done_callback(lambda _: progress_edit_tasks.pop(key, None))
+
+
+async def edit_progress_message(bot, chat_id: int, message_id: int, text: str, reply_markup) -> None:
+    """Edit a progress message once; a failed edit is logged and skipped, never retried."""
+    try:
+        await bot.edit_message_text(
+            text=text,
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=reply_markup,
+            # A progress update is stale by the time a flood wait is over
+            rate_limit_args={"max_retries": 0},
+        )
+        logger.debug("Progress message %s: %s", message_id, text)
+    except telegram.error.RetryAfter as e:
+        logger.debug("Skipped progress edit of message %s: %s", message_id, e)
+    except telegram.error.BadRequest as e:
+        if is_message_not_modified(e):
+            logger.debug("Progress message %s already shows %r.", message_id, text)
+        else:
+            logger.warning("Failed to edit progress message %s: %s", message_id, e)
+    except Exception as e:
+        logger.warning("Generic error editing progress message %s: %s", message_id, e)
+
+
+async def wait_for_progress_edit(chat_id: int, message_id: int) -> None:
+    """Wait for a message's background progress edit, so it can't overwrite a later status."""
+    task = progress_edit_tasks.get((chat_id, message_id))
+    if task:
+        await asyncio.wait([task])
+
+
 async def pyrogram_upload_progress(
     current, total, chat_id, message_id, ptb_bot_instance, video_id
 ):
     """Pyrogram progress callback to update upload status."""
-    percentage = int((current / total) * 100)
-    now = asyncio.get_event_loop().time()
-    last_edit_time = progress_message_last_edit_time.get(
-        (chat_id, message_id), 0
-    )
+    percentage = (current * 100) // total if total else 0
 
-    # Use composite key (chat_id, video_id)
-    operation_key = (chat_id, video_id)
-    if active_operations.get(operation_key, {}).get("cancelled", False):
+    # Use composite key (chat_id, video_id); looked up once per chunk for
+    # both the cancel check and the edit throttle
+    operation = active_operations.get((chat_id, video_id))
+    if operation is None:
+        return
+    if operation["cancelled"]:
         logger.info(f"Cancellation detected during Pyrogram upload for chat_id {chat_id}, video_id {video_id}")
         raise Exception("Upload cancelled by user")
 
-    if now - last_edit_time > 1.0:  # Edit at most once per second
-        try:
-            await ptb_bot_instance.edit_message_text(
-                text=f"Uploading: {percentage}%",
-                chat_id=chat_id,
-                message_id=message_id,
-                reply_markup=get_cancel_keyboard(chat_id, video_id),
-            )
-            progress_message_last_edit_time[(chat_id, message_id)] = now
-            logger.debug(
-                f"Pyrogram Upload Progress: {percentage}% for chat "
-                f"{chat_id}, msg {message_id}"
-            )
-        except telegram.error.BadRequest as e:
-            if "message is not modified" in str(e).lower():
-                logger.debug(
-                    f"Progress message {message_id} already at "
-                    f"{percentage}%."
-                )
-            else:
-                logger.warning(
-                    f"Failed to edit progress message {message_id} for "
-                    f"Pyrogram upload: {e}"
-                )
-        except Exception as e:
-            logger.warning(
-                f"Generic error editing progress message {message_id} for "
-                f"Pyrogram upload: {e}"
-            )
+    if (
+        (chat_id, message_id) not in progress_edit_tasks
+        and should_edit_progress(operation, current, percentage)
+    ):
+        start_progress_edit(
+            ptb_bot_instance, chat_id, message_id, f"Uploading: {percentage}%",
+            get_cancel_keyboard(chat_id, video_id),
+        )
+
+
+async def start_pyrogram_client() -> None:
+    """Start the shared Pyrogram client used for large file uploads."""
+    global pyrogram_app
+
+    if not API_ID_INT or not API_HASH:
+        return
+
+    client = PyrogramClient(
+        name="pyrogram_bot_session",
+        api_id=API_ID_INT,
+        api_hash=API_HASH,
+        bot_token=TELEGRAM_BOT_TOKEN,
+        # Pyrogram transfers one file at a time per client by default; the
+        # shared client must serve every concurrent download slot's upload
+        max_concurrent_transmissions=MAX_CONCURRENT_DOWNLOADS,
+        # Only used for uploads; PTB handles the bot's updates, so don't
+        # receive and dispatch them here for the life of the process
+        no_updates=True,
+    )
+    try:
+        await client.start()
+    except Exception as e:
+        logger.error(f"Failed to start Pyrogram client: {e}", exc_info=True)
+        return
+
+    pyrogram_app = client
+    logger.info("Pyrogram client started")
+
+
+async def get_pyrogram_app() -> PyrogramClient | None:
+    """Return the shared Pyrogram client, starting it first if it isn't running."""
+    if pyrogram_app is None:
+        async with pyrogram_start_lock:
+            # Another upload may have started it while we waited for the lock
+            if pyrogram_app is None:
+                await start_pyrogram_client()
+    return pyrogram_app
+
+
+async def stop_pyrogram_client() -> None:
+    """Stop the shared Pyrogram client, if it was started."""
+    global pyrogram_app
+
+    if pyrogram_app is None:
+        return
+
+    try:
+        await pyrogram_app.stop()
+        logger.info("Pyrogram client stopped")
+    except Exception as e:
+        logger.warning(f"Error stopping Pyrogram client: {e}")
+    finally:
+        pyrogram_app = None
 
 
 async def send_audio_with_pyrogram(
@@ -719,15 +1178,14 @@ async def send_audio_with_pyrogram(
     caption: str | None = None,
 ) -> bool:
     """Send an audio file using Pyrogram, suitable for larger files."""
-    if not API_ID or not API_HASH:
+    app = await get_pyrogram_app()
+    if app is None:
         logger.error(
-            "Pyrogram API_ID or API_HASH not configured. Cannot send "
-            "large file."
+            "Pyrogram client is not running (check API_ID and API_HASH). "
+            "Cannot send large file."
         )
         return False
 
-    pyrogram_session_name = "pyrogram_bot_session"
-
     progress_args_tuple = None
     # Ensure attributes exist
     if (
@@ -749,59 +1207,35 @@ async def send_audio_with_pyrogram(
         )
 
     try:
-        effective_api_id = 0
-        try:
-            effective_api_id = int(API_ID)
-        except (ValueError, TypeError):
-            logger.error(f"Invalid API_ID: '{API_ID}'. Must be an integer.")
-            return False
-
-        async with PyrogramClient(
-            name=pyrogram_session_name,
-            api_id=effective_api_id,
-            api_hash=API_HASH,
-            bot_token=TELEGRAM_BOT_TOKEN,
-            in_memory=True,
-        ) as app:
-            logger.info(
-                f"Pyrogram client sending audio: {file_path} to {chat_id} "
-                "with progress."
-            )
-            await app.send_audio(
-                chat_id=chat_id,
-                audio=file_path,
-                caption=caption or "",
-                progress=pyrogram_upload_progress
-                if progress_args_tuple
-                else None,
-                progress_args=progress_args_tuple
-                if progress_args_tuple
-                else (),
-            )
-            logger.info(
-                f"Pyrogram successfully sent audio: {file_path} to {chat_id}"
-            )
-            if progress_args_tuple:
-                progress_message_last_edit_time.pop(
-                    (progress_args_tuple[0], progress_args_tuple[1]), None
-                )
-            return True
+        logger.info(
+            f"Pyrogram client sending audio: {file_path} to {chat_id} "
+            "with progress."
+        )
+        # Upload from the finished file rather than a pipe: Pyrogram seeks
+        # to the end of the input to size the upload and split it into parts
+        await app.send_audio(
+            chat_id=chat_id,
+            audio=file_path,
+            caption=caption or "",
+            progress=pyrogram_upload_progress
+            if progress_args_tuple
+            else None,
+            progress_args=progress_args_tuple
+            if progress_args_tuple
+            else (),
+        )
+        logger.info(
+            f"Pyrogram successfully sent audio: {file_path} to {chat_id}"
+        )
+        return True
     except FloodWait as e_flood:
         logger.error(
             f"Pyrogram FloodWait: Must wait {e_flood.value} seconds before "
             f"sending to {chat_id}."
         )
-        if progress_args_tuple:
-            progress_message_last_edit_time.pop(
-                (progress_args_tuple[0], progress_args_tuple[1]), None
-            )
         return False
     except Exception as e:
         logger.error(f"Error sending audio with Pyrogram: {e}", exc_info=True)
-        if progress_args_tuple:
-            progress_message_last_edit_time.pop(
-                (progress_args_tuple[0], progress_args_tuple[1]), None
-            )
         return False
 
 
@@ -814,9 +1248,11 @@ async def handle_message(
     if not message_text or update.callback_query:
         return
 
-    logger.debug(f"handle_message received text: '{message_text[:50]}...'")
+    logger.debug("handle_message received text: '%.50s...'", message_text)
 
-    match = re.search(YOUTUBE_URL_REGEX, message_text)
+    # Cheap substring check first: most chat messages contain no link at all
+    # and never need to go through the regex engine
+    match = YOUTUBE_URL_RE.search(message_text) if "youtu" in message_text else None
     if match:
         youtube_url = match.group(0)
         video_id = match.group(1)
@@ -825,7 +1261,13 @@ async def handle_message(
             f"Received YouTube URL: {youtube_url} from chat_id: {chat_id}"
         )
 
-        # Store the URL for later use in callbacks (with timestamp for cleanup)
+        # Store the URL for later use in callbacks (with timestamp for cleanup).
+        # Entries stay in insertion order, so re-insert a repeated link at the
+        # end and drop the oldest ones when a burst of links outpaces the
+        # periodic expiry.
+        pending_video_urls.pop(video_id, None)
+        while len(pending_video_urls) >= MAX_PENDING_URLS:
+            pending_video_urls.pop(next(iter(pending_video_urls)))
         pending_video_urls[video_id] = {
             "url": youtube_url,
             "timestamp": time.time(),
@@ -844,13 +1286,13 @@ async def handle_message(
     # Non-YouTube message handling
     else:
         logger.debug(
-            f"Non-URL message from "
-            f"{update.effective_user.id if update.effective_user else 'N/A'}"
-            f": '{message_text[:50]}...'"
+            "Non-URL message from %s: '%.50s...'",
+            update.effective_user.id if update.effective_user else "N/A",
+            message_text,
         )
         await update.message.reply_text(
             "Please send a YouTube video link. Tap button for how-to.",
-            reply_markup=get_info_inline_keyboard(),
+            reply_markup=INFO_INLINE_KEYBOARD,
         )
 
 
@@ -890,7 +1332,6 @@ async def process_audio_download(
                     try:
                         await processing_message.edit_text(
                             "Download cancelled.",
-                            reply_markup=get_info_inline_keyboard()
                         )
                     except Exception:
                         pass
@@ -907,59 +1348,35 @@ async def process_audio_download(
                 logger.warning(f"Could not edit message: {e}")
 
             try:
-                audio_file_path = await download_and_convert_youtube(youtube_url, video_id)
+                audio_file_path = await get_audio_file(youtube_url, video_id)
             except YouTubeError as yt_err:
                 # Show the YouTube error in a user-friendly format
                 raw_error = str(yt_err)
                 user_message = format_youtube_error_for_user(raw_error)
                 logger.info(f"Showing YouTube error to user: {raw_error}")
-                if processing_message:
-                    try:
-                        await processing_message.edit_text(
-                            user_message,
-                            reply_markup=get_info_inline_keyboard(),
-                            parse_mode="Markdown"
-                        )
-                    except Exception:
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text=user_message,
-                            reply_markup=get_info_inline_keyboard(),
-                            parse_mode="Markdown"
-                        )
-                else:
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text=user_message,
-                        reply_markup=get_info_inline_keyboard(),
-                        parse_mode="Markdown"
-                    )
+                await send_final_status(
+                    context, chat_id, processing_message, user_message,
+                    parse_mode="Markdown",
+                )
                 return
 
             # Store file path for cleanup
             if audio_file_path:
                 active_operations[operation_key]["file_path"] = audio_file_path
 
-            # Check if cancelled
+            # Check if cancelled (the finally block removes the file)
             if active_operations.get(operation_key, {}).get("cancelled", False):
-                if audio_file_path and os.path.exists(audio_file_path):
-                    try:
-                        os.remove(audio_file_path)
-                        logger.info(f"Removed cancelled audio file: {audio_file_path}")
-                    except OSError:
-                        pass
                 if processing_message:
                     try:
                         await processing_message.edit_text(
                             "Download cancelled.",
-                            reply_markup=get_info_inline_keyboard()
                         )
                     except Exception:
                         pass
                 return
 
             if audio_file_path:
-                file_size = os.path.getsize(audio_file_path)
+                file_size = os.stat(audio_file_path).st_size
                 logger.info(f"Audio file created: {audio_file_path}, Size: {file_size} bytes")
 
                 TELEGRAM_AUDIO_LIMIT_BYTES = 50 * 1024 * 1024
@@ -984,6 +1401,8 @@ async def process_audio_download(
                         video_id,
                         caption=f"Audio from YouTube",
                     )
+                    if processing_message:
+                        await wait_for_progress_edit(chat_id, processing_message.message_id)
 
                     # Check if cancelled during upload
                     if active_operations.get(operation_key, {}).get("cancelled", False):
@@ -991,7 +1410,6 @@ async def process_audio_download(
                             try:
                                 await processing_message.edit_text(
                                     "Upload cancelled.",
-                                    reply_markup=get_info_inline_keyboard()
                                 )
                             except Exception:
                                 pass
@@ -999,21 +1417,14 @@ async def process_audio_download(
 
                     if pyrogram_sent:
                         audio_sent_successfully = True
-                        if processing_message:
-                            try:
-                                await processing_message.delete()
-                            except Exception:
-                                pass
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text="Large audio sent! Send another link to download.",
-                            reply_markup=get_info_inline_keyboard(),
+                        await send_final_status(
+                            context, chat_id, processing_message,
+                            "Large audio sent! Send another link to download.",
                         )
                     else:
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text="Failed to send large audio file.",
-                            reply_markup=get_info_inline_keyboard(),
+                        await send_final_status(
+                            context, chat_id, processing_message,
+                            "Failed to send large audio file.",
                         )
                 else:
                     # File is small enough for PTB
@@ -1029,70 +1440,83 @@ async def process_audio_download(
 
                     try:
                         title_without_ext = os.path.splitext(os.path.basename(audio_file_path))[0]
-                        with open(audio_file_path, "rb") as audio_file_obj:
-                            await context.bot.send_audio(
-                                chat_id=chat_id,
-                                audio=audio_file_obj,
-                                filename=os.path.basename(audio_file_path),
-                                title=title_without_ext,
-                                read_timeout=180,
-                                write_timeout=180,
-                                connect_timeout=180,
-                            )
-                        audio_sent_successfully = True
-                        if processing_message:
-                            try:
-                                await processing_message.delete()
-                            except Exception:
-                                pass
-                        await context.bot.send_message(
+                        # PTB reads a file or path input completely in the
+                        # event loop before uploading; read it (at most 50 MB
+                        # here) in a worker thread instead
+                        audio_bytes = await asyncio.to_thread(
+                            Path(audio_file_path).read_bytes
+                        )
+                        await context.bot.send_audio(
                             chat_id=chat_id,
-                            text="Audio sent! Send another link to download.",
-                            reply_markup=get_info_inline_keyboard(),
+                            audio=audio_bytes,
+                            filename=os.path.basename(audio_file_path),
+                            title=title_without_ext,
+                            read_timeout=180,
+                            write_timeout=180,
+                            connect_timeout=180,
+                        )
+                        audio_sent_successfully = True
+                        await send_final_status(
+                            context, chat_id, processing_message,
+                            "Audio sent! Send another link to download.",
                         )
                     except Exception as e_send:
                         logger.error(f"Failed to send audio: {e_send}", exc_info=True)
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text=f"Error sending audio: {e_send}",
-                            reply_markup=get_info_inline_keyboard(),
+                        await send_final_status(
+                            context, chat_id, processing_message,
+                            f"Error sending audio: {e_send}",
                         )
-            else:
-                logger.warning(f"download_and_convert_youtube returned None for {youtube_url}")
-                if processing_message:
-                    try:
-                        await processing_message.edit_text(
-                            "Couldn't process YouTube link. Try again later.",
-                            reply_markup=get_info_inline_keyboard()
-                        )
-                    except Exception:
-                        pass
-                else:
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text="Couldn't process YouTube link. Try again later.",
-                        reply_markup=get_info_inline_keyboard(),
-                    )
+            else:
+                logger.warning(f"download_and_convert_youtube returned None for {youtube_url}")
+                await send_final_status(
+                    context, chat_id, processing_message,
+                    "Couldn't process YouTube link. Try again later.",
+                )
 
     except Exception as e:
         logger.error(f"Error in process_audio_download: {e}", exc_info=True)
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=f"An error occurred: {e}",
-            reply_markup=get_info_inline_keyboard(),
+        await send_final_status(
+            context, chat_id, processing_message,
+            f"An error occurred: {e}",
         )
 
     finally:
         # Clean up active operation using composite key
         active_operations.pop(operation_key, None)
 
-        # Cleanup temp file
-        if audio_file_path and os.path.exists(audio_file_path):
-            try:
-                os.remove(audio_file_path)
-                logger.info(f"Removed temp file: {audio_file_path}")
-            except OSError as e:
-                logger.error(f"Error removing temp file: {e}")
+        # Cleanup the per-request work directory holding the temp file;
+        # files served from the audio cache stay for the next request
+        if audio_file_path and not Path(audio_file_path).is_relative_to(AUDIO_CACHE_DIR):
+            await asyncio.to_thread(
+                shutil.rmtree, os.path.dirname(audio_file_path), ignore_errors=True
+            )
+            logger.info(f"Removed temp file: {audio_file_path}")
+
+
+def release_video_download(download_key: tuple) -> None:
+    """Drop one request's use of a shared video download; the last one removes its files."""
+    shared_download = video_downloads_in_flight[download_key]
+    shared_download["users"] -= 1
+    if shared_download["users"] > 0:
+        return
+    del video_downloads_in_flight[download_key]
+    # Runs right away if the download is done, otherwise once it finishes
+    shared_download["future"].add_done_callback(remove_video_download_files)
+
+
+def remove_video_download_files(future: asyncio.Future) -> None:
+    """Remove the work directory of a finished video download."""
+    # A failed download_youtube_video already removed its work directory
+    if future.cancelled() or future.exception() is not None:
+        return
+    video_file_path = future.result()
+    if video_file_path:
+        # Done callbacks run on the event loop; removing a multi-GB file can
+        # block for a while, so leave it to a worker thread
+        asyncio.get_running_loop().run_in_executor(
+            None, shutil.rmtree, os.path.dirname(video_file_path), True
+        )
+        logger.info(f"Removing temp video file: {video_file_path}")
 
 
 async def process_video_download(
@@ -1102,11 +1526,16 @@ async def process_video_download(
     quality: int,
     context: ContextTypes.DEFAULT_TYPE,
     query,
+    probe_info: dict | None = None,
 ) -> None:
-    """Process video download request at specified quality."""
+    """
+    Process video download request at specified quality.
+    probe_info is the quality probe's info dict, reused by the download if given.
+    """
     processing_message = None
     video_file_path = None
     video_sent_successfully = False
+    download_key = None
 
     # Use composite key (chat_id, video_id) for cancellation support
     operation_key = (chat_id, video_id)
@@ -1132,19 +1561,11 @@ async def process_video_download(
                     try:
                         await processing_message.edit_text(
                             "Download cancelled.",
-                            reply_markup=get_info_inline_keyboard()
                         )
                     except Exception:
                         pass
                 return
 
-            # Create local progress tracker for this download
-            download_progress = DownloadProgress()
-
-            # Local progress hook that updates the tracker
-            def progress_hook(d):
-                download_progress.update(d)
-
             # Edit the original message to show processing status with cancel button
             try:
                 await query.edit_message_text(
@@ -1155,110 +1576,101 @@ async def process_video_download(
             except Exception as e:
                 logger.warning(f"Could not edit message: {e}")
 
-            # Run download in a thread executor while updating progress
-            loop = asyncio.get_event_loop()
-
-            # Start download in background thread
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                future = loop.run_in_executor(
-                    executor,
-                    lambda: download_youtube_video(youtube_url, video_id, quality, [progress_hook])
-                )
-
-                # Update progress message while downloading
-                last_progress_text = ""
-                last_update_time = 0
+            # Run download in the shared download thread pool while updating
+            # progress. If the same video is already being downloaded at this
+            # quality (e.g. a double tap), wait for that download and share
+            # its file and progress instead of fetching it twice.
+            shared_download = video_downloads_in_flight.get((video_id, quality))
+            if shared_download:
+                shared_download["users"] += 1
+                logger.info(f"Joining in-flight download of {video_id} at {quality}p")
+            else:
+                download_progress = DownloadProgress()
+                loop = asyncio.get_running_loop()
+                shared_download = video_downloads_in_flight[(video_id, quality)] = {
+                    "future": loop.run_in_executor(
+                        download_executor,
+                        download_youtube_video,
+                        youtube_url, video_id, quality, [download_progress.update],
+                        probe_info,
+                    ),
+                    "progress": download_progress,
+                    "users": 1,
+                }
+            download_key = (video_id, quality)
+            future = shared_download["future"]
+            download_progress = shared_download["progress"]
 
-                while not future.done():
-                    await asyncio.sleep(1.5)  # Check every 1.5 seconds
+            # Update progress message while downloading
+            last_progress_text = ""
+            last_update_time = 0
 
-                    # Check if cancelled
-                    if active_operations.get(operation_key, {}).get("cancelled", False):
-                        logger.info(f"Download cancelled for chat_id: {chat_id}, video_id: {video_id}")
-                        # We can't stop the download thread, but we'll clean up after
-                        break
+            while not future.done():
+                await asyncio.sleep(1.5)  # Check every 1.5 seconds
 
-                    # Get current progress text from local tracker
-                    progress_text = download_progress.get_progress_text(quality)
+                # Check if cancelled
+                if active_operations.get(operation_key, {}).get("cancelled", False):
+                    logger.info(f"Download cancelled for chat_id: {chat_id}, video_id: {video_id}")
+                    # We can't stop the download thread, but we'll clean up after
+                    break
 
-                    # Only update if text changed and enough time has passed (rate limiting)
-                    current_time = asyncio.get_event_loop().time()
-                    if progress_text != last_progress_text and (current_time - last_update_time) > 2:
-                        if processing_message:
-                            try:
-                                await processing_message.edit_text(
-                                    progress_text,
-                                    reply_markup=get_cancel_keyboard(chat_id, video_id)
-                                )
-                                last_progress_text = progress_text
-                                last_update_time = current_time
-                            except Exception as e:
-                                logger.debug(f"Could not update progress: {e}")
+                # Get current progress text from local tracker
+                progress_text = download_progress.get_progress_text(quality)
 
-                # Check if operation was cancelled
-                if active_operations.get(operation_key, {}).get("cancelled", False):
-                    # Don't wait for download to complete - show cancelled message immediately
-                    if processing_message:
-                        try:
-                            await processing_message.edit_text(
-                                "Download cancelled.",
-                                reply_markup=get_info_inline_keyboard()
-                            )
-                        except Exception:
-                            pass
+                # Only update if text changed and enough time has passed (rate limiting)
+                current_time = time.monotonic()
+                if (
+                    processing_message
+                    and progress_text != last_progress_text
+                    and (current_time - last_update_time) > 2
+                    and (chat_id, processing_message.message_id) not in progress_edit_tasks
+                    and take_progress_edit_token(current_time)
+                ):
+                    start_progress_edit(
+                        context.bot, chat_id, processing_message.message_id,
+                        progress_text, get_cancel_keyboard(chat_id, video_id),
+                    )
+                    last_progress_text = progress_text
+                    last_update_time = current_time
 
-                    # Clean up active operation
-                    active_operations.pop(operation_key, None)
+            if processing_message:
+                await wait_for_progress_edit(chat_id, processing_message.message_id)
 
-                    # Wait for download to finish in background then clean up file
+            # Check if operation was cancelled
+            if active_operations.get(operation_key, {}).get("cancelled", False):
+                # Don't wait for download to complete - show cancelled message immediately
+                if processing_message:
                     try:
-                        video_file_path = await asyncio.wait_for(
-                            asyncio.wrap_future(future), timeout=60
+                        await processing_message.edit_text(
+                            "Download cancelled.",
                         )
-                        if video_file_path and os.path.exists(video_file_path):
-                            os.remove(video_file_path)
-                            logger.info(f"Removed cancelled download file: {video_file_path}")
-                    except (asyncio.TimeoutError, Exception) as e:
-                        logger.warning(f"Could not clean up cancelled download: {e}")
-                    return
+                    except Exception:
+                        pass
 
-                # Get the result
-                try:
-                    video_file_path = future.result()
-                except YouTubeError as yt_err:
-                    # Show the YouTube error in a user-friendly format
-                    raw_error = str(yt_err)
-                    user_message = format_youtube_error_for_user(raw_error)
-                    logger.info(f"Showing YouTube error to user: {raw_error}")
-                    if processing_message:
-                        try:
-                            await processing_message.edit_text(
-                                user_message,
-                                reply_markup=get_info_inline_keyboard(),
-                                parse_mode="Markdown"
-                            )
-                        except Exception:
-                            await context.bot.send_message(
-                                chat_id=chat_id,
-                                text=user_message,
-                                reply_markup=get_info_inline_keyboard(),
-                                parse_mode="Markdown"
-                            )
-                    else:
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text=user_message,
-                            reply_markup=get_info_inline_keyboard(),
-                            parse_mode="Markdown"
-                        )
-                    return
+                # The finally block releases the download; its file is removed
+                # once the download finishes, without holding this handler
+                return
+
+            # Get the result
+            try:
+                video_file_path = future.result()
+            except YouTubeError as yt_err:
+                # Show the YouTube error in a user-friendly format
+                raw_error = str(yt_err)
+                user_message = format_youtube_error_for_user(raw_error)
+                logger.info(f"Showing YouTube error to user: {raw_error}")
+                await send_final_status(
+                    context, chat_id, processing_message, user_message,
+                    parse_mode="Markdown",
+                )
+                return
 
-                # Store file path for cleanup (use .get() in case operation was cancelled)
-                if video_file_path and operation_key in active_operations:
-                    active_operations[operation_key]["file_path"] = video_file_path
+            # Store file path for cleanup (use .get() in case operation was cancelled)
+            if video_file_path and operation_key in active_operations:
+                active_operations[operation_key]["file_path"] = video_file_path
 
             if video_file_path:
-                file_size = os.path.getsize(video_file_path)
+                file_size = os.stat(video_file_path).st_size
                 file_size_mb = file_size // (1024 * 1024)
                 logger.info(f"Video file created: {video_file_path}, Size: {file_size_mb}MB")
                 
@@ -1267,10 +1679,9 @@ async def process_video_download(
                 TELEGRAM_PTB_LIMIT_BYTES = 50 * 1024 * 1024
                 
                 if file_size > TELEGRAM_VIDEO_LIMIT_BYTES:
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text=f"Video is too large ({file_size_mb}MB). Telegram limit is 2GB.",
-                        reply_markup=get_info_inline_keyboard(),
+                    await send_final_status(
+                        context, chat_id, processing_message,
+                        f"Video is too large ({file_size_mb}MB). Telegram limit is 2GB.",
                     )
                     return
                 
@@ -1294,6 +1705,8 @@ async def process_video_download(
                         video_id,
                         caption=f"{quality}p video from YouTube",
                     )
+                    if processing_message:
+                        await wait_for_progress_edit(chat_id, processing_message.message_id)
 
                     # Check if cancelled during upload
                     if active_operations.get(operation_key, {}).get("cancelled", False):
@@ -1301,7 +1714,6 @@ async def process_video_download(
                             try:
                                 await processing_message.edit_text(
                                     "Upload cancelled.",
-                                    reply_markup=get_info_inline_keyboard()
                                 )
                             except Exception:
                                 pass
@@ -1309,21 +1721,14 @@ async def process_video_download(
 
                     if pyrogram_sent:
                         video_sent_successfully = True
-                        if processing_message:
-                            try:
-                                await processing_message.delete()
-                            except Exception:
-                                pass
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text="Video sent! Send another link to download.",
-                            reply_markup=get_info_inline_keyboard(),
+                        await send_final_status(
+                            context, chat_id, processing_message,
+                            "Video sent! Send another link to download.",
                         )
                     else:
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text="Failed to send video file.",
-                            reply_markup=get_info_inline_keyboard(),
+                        await send_final_status(
+                            context, chat_id, processing_message,
+                            "Failed to send video file.",
                         )
                 else:
                     # File is small enough for PTB
@@ -1338,70 +1743,58 @@ async def process_video_download(
                             pass
 
                     try:
-                        with open(video_file_path, "rb") as video_file_obj:
-                            await context.bot.send_video(
-                                chat_id=chat_id,
-                                video=video_file_obj,
-                                filename=os.path.basename(video_file_path),
-                                caption=f"{quality}p video",
-                                read_timeout=300,
-                                write_timeout=300,
-                                connect_timeout=180,
-                                supports_streaming=True,
-                            )
-                        video_sent_successfully = True
-                        if processing_message:
-                            try:
-                                await processing_message.delete()
-                            except Exception:
-                                pass
-                        await context.bot.send_message(
+                        # Read the file (at most 50 MB here) in a worker
+                        # thread, as PTB would read it in the event loop
+                        video_bytes = await asyncio.to_thread(
+                            Path(video_file_path).read_bytes
+                        )
+                        await context.bot.send_video(
                             chat_id=chat_id,
-                            text="Video sent! Send another link to download.",
-                            reply_markup=get_info_inline_keyboard(),
+                            video=video_bytes,
+                            filename=os.path.basename(video_file_path),
+                            caption=f"{quality}p video",
+                            read_timeout=300,
+                            write_timeout=300,
+                            connect_timeout=180,
+                            supports_streaming=True,
+                        )
+                        video_sent_successfully = True
+                        await send_final_status(
+                            context, chat_id, processing_message,
+                            "Video sent! Send another link to download.",
                         )
                     except Exception as e_send:
                         logger.error(f"Failed to send video: {e_send}", exc_info=True)
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text=f"Error sending video: {e_send}",
-                            reply_markup=get_info_inline_keyboard(),
+                        await send_final_status(
+                            context, chat_id, processing_message,
+                            f"Error sending video: {e_send}",
                         )
             else:
                 logger.warning(f"download_youtube_video returned None for {youtube_url}")
-                if processing_message:
-                    try:
-                        await processing_message.edit_text(
-                            "Couldn't download video. Try a different quality or try again later."
-                        )
-                    except Exception:
-                        pass
-                else:
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text="Couldn't download video. Try again later.",
-                        reply_markup=get_info_inline_keyboard(),
-                    )
+                await send_final_status(
+                    context, chat_id, processing_message,
+                    "Couldn't download video. Try a different quality or try again later.",
+                )
     
     except Exception as e:
         logger.error(f"Error in process_video_download: {e}", exc_info=True)
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=f"An error occurred: {e}",
-            reply_markup=get_info_inline_keyboard(),
+        await send_final_status(
+            context, chat_id, processing_message,
+            f"An error occurred: {e}",
         )
     
     finally:
         # Clean up active operation using composite key
         active_operations.pop(operation_key, None)
 
-        # Cleanup temp file
-        if video_file_path and os.path.exists(video_file_path):
-            try:
-                os.remove(video_file_path)
-                logger.info(f"Removed temp video file: {video_file_path}")
-            except OSError as e:
-                logger.error(f"Error removing temp video file: {e}")
+        # Release the (possibly shared) download; the last request using it
+        # removes the work directory holding the temp file
+        if download_key:
+            release_video_download(download_key)
+
+
+# Deletes characters that are not allowed in filenames in a single pass
+INVALID_FILENAME_CHARS_TABLE = str.maketrans('', '', '<>:"/\\|?*')
 
 
 def sanitize_filename(title: str, max_length: int = 200) -> str:
@@ -1409,13 +1802,7 @@ def sanitize_filename(title: str, max_length: int = 200) -> str:
     Sanitize a video title to create a safe filename.
     Keeps spaces but removes/replaces problematic characters.
     """
-    # Characters that are not allowed in filenames
-    invalid_chars = ['<', '>', ':', '"', '/', '\\', '|', '?', '*']
-
-    # Replace invalid characters with nothing or space
-    sanitized = title
-    for char in invalid_chars:
-        sanitized = sanitized.replace(char, '')
+    sanitized = title.translate(INVALID_FILENAME_CHARS_TABLE)
 
     # Replace multiple spaces with single space
     sanitized = ' '.join(sanitized.split())
@@ -1514,6 +1901,157 @@ def format_youtube_error_for_user(error_message: str) -> str:
     return f"❌ **Download Failed**\n\n{cleaned}"
 
 
+def scan_download_artifacts(workdir: str, video_id: str) -> tuple[list[str], list[str]]:
+    """
+    List what a download left in its work directory, in a single scandir pass.
+
+    Returns (pre_ffmpeg, other): files yt-dlp downloaded for the video that
+    never got converted to MP3, and everything else in the directory.
+    """
+    pre_ffmpeg = []
+    other = []
+    with os.scandir(workdir) as entries:
+        for entry in entries:
+            if entry.name.startswith(video_id) and not entry.name.endswith(".mp3"):
+                pre_ffmpeg.append(entry.name)
+            else:
+                other.append(entry.name)
+    return pre_ffmpeg, other
+
+
+def remove_work_files(workdir: str, names: list[str]) -> None:
+    """Remove the named files from a work directory (blocking)."""
+    for name in names:
+        try:
+            os.unlink(os.path.join(workdir, name))
+        except FileNotFoundError:
+            pass
+
+
+def clear_work_dir(workdir: str) -> None:
+    """Remove everything in a work directory, keeping the directory (blocking)."""
+    with os.scandir(workdir) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+def record_strategy_failure(name: str) -> None:
+    """Count a strategy-specific failure towards skipping that strategy."""
+    failures, _ = strategy_failures.get(name, (0, 0.0))
+    strategy_failures[name] = (failures + 1, time.monotonic())
+
+
+def is_strategy_skipped(name: str, now: float) -> bool:
+    """Return True if the strategy failed too often recently to be worth trying."""
+    failures, last_failure = strategy_failures.get(name, (0, 0.0))
+    return (
+        failures >= STRATEGY_FAILURE_THRESHOLD
+        and now - last_failure < STRATEGY_COOLDOWN_SECONDS
+    )
+
+
+def run_ytdl_download(ydl_opts: dict, url: str) -> dict | None:
+    """Download a URL with yt-dlp (blocking) and return its info dict."""
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        return ydl.extract_info(url, download=True)
+
+
+# Audio download strategies, tried in order by download_and_convert_youtube.
+# Optimized strategy - using the proven working method
+# (Firefox cookies + TV client)
+AUDIO_DOWNLOAD_STRATEGIES = (
+    # Primary strategy: Firefox cookies with TV client (proven to work)
+    {
+        "name": "firefox_cookies_tv_client",
+        "requires": {"firefox_cookies"},
+        "opts": {
+            "cookiesfrombrowser": ("firefox",),
+            "format": "bestaudio/best[height<=480]/worst",
+            "extractor_args": {
+                "youtube": {"player_client": ["tv", "web"]}
+            },
+        },
+    },
+    # Fallback strategy: Basic approach without cookies
+    {
+        "name": "basic_fallback",
+        "opts": {
+            "format": "bestaudio/best[height<=480]/worst",
+            "extractor_args": {
+                "youtube": {
+                    "player_client": ["android", "web"],
+                    "player_skip": ["webpage"],
+                    "formats": "missing_pot",
+                }
+            },
+            # No ignoreerrors: a swallowed error can't be told apart from a
+            # broken strategy, so YouTube errors about the video itself
+            # (private, removed, geo-blocked) would count as strategy failures
+        },
+    },
+)
+
+# Options shared by every audio download strategy; only outtmpl is per call
+AUDIO_BASE_YDL_OPTS = {
+    "postprocessors": [
+        {
+            "key": "FFmpegExtractAudio",
+            "preferredcodec": "mp3",
+            # Use 192kbps instead of 0 for more consistent results
+            "preferredquality": "192",
+        }
+    ],
+    "noplaylist": True,
+    "logger": logger,
+    "verbose": YTDL_VERBOSE,
+    # Per-step status lines only when debugging; warnings and errors still
+    # reach the logger
+    "quiet": not YTDL_VERBOSE,
+    "noprogress": True,
+    "ignoreerrors": False,
+    "progress_hooks": [ytdl_progress_hook],
+    # More robust user agent
+    "http_headers": {
+        "User-Agent": (
+            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+            "AppleWebKit/537.36 (KHTML, like Gecko) "
+            "Chrome/120.0.0.0 Safari/537.36"
+        ),
+        "Accept": (
+            "text/html,application/xhtml+xml,application/xml;q=0.9,"
+            "*/*;q=0.8"
+        ),
+        "Accept-Language": "en-us,en;q=0.5",
+        "Sec-Fetch-Mode": "navigate",
+    },
+    # Additional options to help with extraction
+    "extract_flat": False,
+    "age_limit": None,
+    "geo_bypass": True,
+    # Fetch DASH/HLS fragments in parallel and download progressive
+    # streams in chunks instead of one long-lived connection
+    "concurrent_fragment_downloads": 8,
+    "http_chunk_size": 10 * 1024 * 1024,  # 10 MB
+    "retries": YTDL_RETRIES,
+    "fragment_retries": YTDL_RETRIES,
+    "retry_sleep_functions": YTDL_RETRY_SLEEP_FUNCTIONS,
+    "throttledratelimit": YTDL_THROTTLED_RATE_LIMIT,
+    "socket_timeout": 30,
+    "ffmpeg_location": FFMPEG_LOCATION,
+}
+
+# Merge each strategy's options over the base options once, at import
+for _strategy in AUDIO_DOWNLOAD_STRATEGIES:
+    _strategy["ydl_opts"] = {**AUDIO_BASE_YDL_OPTS, **_strategy["opts"]}
+del _strategy
+
+
 async def download_and_convert_youtube(url: str, video_id: str) -> str | None:
     """
     Download a YouTube video and convert it to an MP3 file.
@@ -1525,162 +2063,177 @@ async def download_and_convert_youtube(url: str, video_id: str) -> str | None:
     Raises:
         YouTubeError: When YouTube returns a user-facing error (geo-restriction, etc.)
     """
-    # Download to temp directory with video_id first, then rename to title
-    base_output_template = str(TEMP_DIR / video_id)
-    temp_final_path = f"{base_output_template}.mp3"
-    expected_final_path = None
+    global last_successful_audio_strategy
+
+    # Download into a private work directory per request, so concurrent
+    # requests never share yt-dlp's .part/intermediate files or final names.
+    # The caller removes the whole directory once the MP3 has been sent.
+    workdir = tempfile.mkdtemp(prefix=f"{video_id}_", dir=TEMP_DIR)
+
+    # Download with video_id first, then rename to title
+    base_output_template = os.path.join(workdir, video_id)
 
-    # Optimized strategy - using the proven working method
-    # (Firefox cookies + TV client)
+    # Drop strategies that can't work on this host before trying any
     download_strategies = [
-        # Primary strategy: Firefox cookies with TV client (proven to work)
-        {
-            "name": "firefox_cookies_tv_client",
-            "opts": {
-                "cookiesfrombrowser": ("firefox",),
-                "format": "bestaudio/best[height<=480]/worst",
-                "extractor_args": {
-                    "youtube": {"player_client": ["tv", "web"]}
-                },
-            },
-        },
-        # Fallback strategy: Basic approach without cookies
-        {
-            "name": "basic_fallback",
-            "opts": {
-                "format": "bestaudio/best[height<=480]/worst",
-                "extractor_args": {
-                    "youtube": {
-                        "player_client": ["android", "web"],
-                        "player_skip": ["webpage"],
-                        "formats": "missing_pot",
-                    }
-                },
-                "ignoreerrors": True,
-            },
-        },
+        s for s in AUDIO_DOWNLOAD_STRATEGIES
+        if s.get("requires", set()) <= HOST_CAPABILITIES
     ]
 
-    base_ydl_opts = {
-        # yt-dlp saves as this, FFmpeg adds .mp3
-        "outtmpl": base_output_template,
-        "postprocessors": [
-            {
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": "mp3",
-                # Use 192kbps instead of 0 for more consistent results
-                "preferredquality": "192",
-            }
-        ],
-        "noplaylist": True,
-        "logger": logger,
-        "verbose": True,
-        "noprogress": True,
-        "ignoreerrors": False,
-        "progress_hooks": [ytdl_progress_hook],
-        # More robust user agent
-        "http_headers": {
-            "User-Agent": (
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                "AppleWebKit/537.36 (KHTML, like Gecko) "
-                "Chrome/120.0.0.0 Safari/537.36"
-            ),
-            "Accept": (
-                "text/html,application/xhtml+xml,application/xml;q=0.9,"
-                "*/*;q=0.8"
-            ),
-            "Accept-Language": "en-us,en;q=0.5",
-            "Sec-Fetch-Mode": "navigate",
-        },
-        # Additional options to help with extraction
-        "extract_flat": False,
-        "age_limit": None,
-        "geo_bypass": True,
-        # Make sure FFmpeg location is either in PATH or specified here
-        # 'ffmpeg_location': '/path/to/your/ffmpeg',
-    }
+    # Skip strategies that keep failing until their cooldown is over; once
+    # it is, one attempt decides whether they are skipped again. If every
+    # strategy is failing, try them all rather than none.
+    now = time.monotonic()
+    usable_strategies = [
+        s for s in download_strategies if not is_strategy_skipped(s["name"], now)
+    ]
+    if usable_strategies:
+        download_strategies = usable_strategies
+
+    # Start with the strategy that worked last time; the rest keep their order
+    if last_successful_audio_strategy:
+        download_strategies.sort(
+            key=lambda s: s["name"] != last_successful_audio_strategy
+        )
 
     # Try downloading with different strategies
     for i, strategy in enumerate(download_strategies):
         try:
-            # Create ydl_opts for this strategy
-            ydl_opts = base_ydl_opts.copy()
-            ydl_opts.update(strategy["opts"])
+            # Create ydl_opts for this strategy. yt-dlp writes into the
+            # options dict it is given, so every attempt gets its own, with
+            # a private copy of the nested extractor_args so nothing done to
+            # them can leak into the shared strategy or other downloads
+            ydl_opts = {
+                **strategy["ydl_opts"],
+                # yt-dlp saves as this, FFmpeg adds .mp3
+                "outtmpl": base_output_template,
+                "extractor_args": copy.deepcopy(strategy["opts"]["extractor_args"]),
+            }
+            if (
+                "cookiesfrombrowser" in ydl_opts
+                and "firefox_cookie_jar" in HOST_CAPABILITIES
+            ):
+                # yt-dlp writes the cookie file back when it finishes, so
+                # each download gets a private copy of the exported jar
+                cookie_file = os.path.join(workdir, "cookies.txt")
+                await asyncio.to_thread(
+                    shutil.copyfile, FIREFOX_COOKIE_JAR_PATH, cookie_file
+                )
+                del ydl_opts["cookiesfrombrowser"]
+                ydl_opts["cookiefile"] = cookie_file
 
             logger.info(
                 f"Attempting download with strategy '{strategy['name']}' for: "
                 f"{url}. Base output: {base_output_template}"
             )
 
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                # Get the video title and sanitize it
-                if info:
-                    video_title = info.get('title', video_id)
-                    sanitized_title = sanitize_filename(video_title)
-                    expected_final_path = str(TEMP_DIR / f"{sanitized_title}.mp3")
+            # Download + FFmpeg conversion block for tens of seconds, so run
+            # them in a worker thread to keep the event loop serving others
+            info = await asyncio.get_running_loop().run_in_executor(
+                download_executor, run_ytdl_download, ydl_opts, url
+            )
+            # yt-dlp reports where the converted file actually ended up
+            downloaded_path = None
+            if info and info.get("requested_downloads"):
+                downloaded_path = info["requested_downloads"][0].get("filepath")
 
             logger.info(
                 f"yt-dlp download & FFmpeg conversion for {url} completed "
                 f"using strategy '{strategy['name']}'."
             )
 
-            # Check if the temp file exists and rename it
-            if os.path.exists(temp_final_path):
-                # Rename from video_id.mp3 to sanitized_title.mp3
+            # Rename to sanitized_title.mp3 (a missing file shows up as
+            # FileNotFoundError, no separate exists() check)
+            expected_final_path = None
+            if downloaded_path:
+                sanitized_title = sanitize_filename(info.get('title', video_id))
+                expected_final_path = os.path.join(workdir, f"{sanitized_title}.mp3")
                 try:
-                    os.rename(temp_final_path, expected_final_path)
+                    os.rename(downloaded_path, expected_final_path)
                     logger.info(
-                        f"Renamed file from {temp_final_path} to "
+                        f"Renamed file from {downloaded_path} to "
                         f"{expected_final_path}"
                     )
+                except FileNotFoundError:
+                    expected_final_path = None
                 except OSError as e_rename:
                     logger.warning(
                         f"Could not rename file: {e_rename}. "
                         f"Using original filename."
                     )
-                    expected_final_path = temp_final_path
+                    expected_final_path = downloaded_path
 
-            if expected_final_path and os.path.exists(expected_final_path):
+            if expected_final_path:
                 logger.info(
                     "Conversion successful. MP3 file created: "
                     f"{expected_final_path}"
                 )
+                last_successful_audio_strategy = strategy["name"]
+                strategy_failures.pop(strategy["name"], None)
                 return expected_final_path
             else:
                 logger.error(
                     "CRITICAL: No MP3 file was found after FFmpeg "
-                    f"processing for {url}."
+                    "processing for %s.", url
                 )
 
-                try:
-                    current_dir_files = os.listdir(".")
-                    logger.error(
-                        "Files in current directory ('.') to help debug: "
-                        f"{current_dir_files}"
-                    )
-                except Exception as e_ls:
-                    logger.error(f"Could not list current directory: {e_ls}")
+                # Not counted as a strategy failure: without an error from
+                # yt-dlp there is nothing showing the strategy is broken
 
-                # If this isn't the last strategy, continue to the next one
-                if i < len(download_strategies) - 1:
+                # Only a download that didn't happen is worth another
+                # strategy: one that finished without leaving an MP3 would
+                # just be downloaded and converted again
+                try_next_strategy = (
+                    i < len(download_strategies) - 1 and not downloaded_path
+                )
+
+                # The work directory is only listed when the result is needed:
+                # to log it at debug level, or to clear this attempt's
+                # leftovers before the next strategy runs
+                pre_ffmpeg_files, other_files = [], []
+                if try_next_strategy or logger.isEnabledFor(logging.DEBUG):
+                    try:
+                        pre_ffmpeg_files, other_files = scan_download_artifacts(
+                            workdir, video_id
+                        )
+                        logger.debug(
+                            "Files left in work directory to help debug: "
+                            "not converted by FFmpeg: %r, other: %r",
+                            pre_ffmpeg_files, other_files,
+                        )
+                    except OSError as e_ls:
+                        logger.debug("Could not list work directory: %s", e_ls)
+
+                if try_next_strategy:
+                    # Reuse the scan above to clear this attempt's leftovers,
+                    # so the next strategy doesn't pick up stale files
+                    await asyncio.to_thread(
+                        remove_work_files, workdir, pre_ffmpeg_files + other_files
+                    )
                     continue
                 else:
+                    await asyncio.to_thread(shutil.rmtree, workdir, ignore_errors=True)
                     return None
 
         except yt_dlp.utils.DownloadError as e:
             error_msg = str(e)
             logger.warning(
-                f"yt-dlp DownloadError with strategy '{strategy['name']}' "
-                f"for {url}: {e}"
+                "yt-dlp DownloadError with strategy '%s' for %s: %s",
+                strategy["name"], url, e,
             )
 
+            # yt-dlp can no longer handle YouTube's player with this strategy,
+            # so stop preferring it until it succeeds again
+            if (
+                "Signature extraction failed" in error_msg
+                and last_successful_audio_strategy == strategy["name"]
+            ):
+                last_successful_audio_strategy = None
+
             # Check if this is a YouTube error that should be shown to user
             # These are errors from YouTube itself, not technical/retry-able errors
             if "ERROR: [youtube]" in error_msg:
-                logger.info(f"YouTube error detected, showing to user: {error_msg}")
-                if expected_final_path and os.path.exists(expected_final_path):
-                    os.remove(expected_final_path)
+                logger.info("YouTube error detected, showing to user: %s", error_msg)
+                await asyncio.to_thread(shutil.rmtree, workdir, ignore_errors=True)
                 # Trim the error - only show first line (before country list or extra details)
                 first_line = error_msg.split('\n')[0]
                 # Also trim if there's "This video is available in" list
@@ -1689,65 +2242,235 @@ async def download_and_convert_youtube(url: str, video_id: str) -> str | None:
                 raise YouTubeError(first_line)
 
             # Check for specific error types and decide whether to continue
+            retryable = bool(RETRYABLE_DOWNLOAD_ERROR_RE.search(error_msg))
+            if retryable:
+                record_strategy_failure(strategy["name"])
             if i < len(download_strategies) - 1:  # Not the last strategy
-                if (
-                    "Sign in to confirm you're not a bot" in error_msg
-                    or "DPAPI" in error_msg
-                    or "Failed to decrypt" in error_msg
-                    or "failed to load cookies" in error_msg.lower()
-                    or "could not find" in error_msg.lower()
-                    or "Invalid po_token" in error_msg
-                    or "Requested format is not available" in error_msg
-                    or "Signature extraction failed" in error_msg
-                    or "HTTP Error 403" in error_msg
-                    or "forbidden" in error_msg.lower()
-                    or "unable to download video data" in error_msg
-                ):
+                if retryable:
                     logger.info(
-                        f"Strategy '{strategy['name']}' failed with known "
-                        "issue, trying next strategy..."
+                        "Strategy '%s' failed with known issue, trying next "
+                        "strategy...", strategy["name"]
                     )
+                    # The next strategy uses another client and format, so
+                    # it must not resume this attempt's .part file
+                    await asyncio.to_thread(clear_work_dir, workdir)
                     continue
 
             # If it's the last strategy, handle cleanup and return None
             logger.error(
-                f"Final yt-dlp DownloadError (tried {i+1} strategies) "
-                f"for {url}: {e}",
-                exc_info=True,
+                "Final yt-dlp DownloadError (tried %d strategies) for %s: "
+                "%s: %s",
+                i + 1, url, type(e).__name__, e,
+                exc_info=DEBUG_TRACEBACKS,
             )
-            if expected_final_path and os.path.exists(expected_final_path):
-                os.remove(expected_final_path)
+            await asyncio.to_thread(shutil.rmtree, workdir, ignore_errors=True)
             return None
 
         except Exception as e:
             logger.warning(
-                f"General error with strategy '{strategy['name']}' "
-                f"for {url}: {e}"
+                "General error with strategy '%s' for %s: %s",
+                strategy["name"], url, e,
             )
+            record_strategy_failure(strategy["name"])
             # If we have more strategies to try, continue
             if i < len(download_strategies) - 1:
                 logger.info(
-                    f"Strategy '{strategy['name']}' failed, trying next "
-                    "strategy..."
+                    "Strategy '%s' failed, trying next strategy...",
+                    strategy["name"],
                 )
+                await asyncio.to_thread(clear_work_dir, workdir)
                 continue
 
             # Last strategy failed, clean up and return None
             logger.error(
-                f"Final general error (tried {i+1} strategies) for {url}: "
-                f"{e}",
-                exc_info=True,
+                "Final general error (tried %d strategies) for %s: %s: %s",
+                i + 1, url, type(e).__name__, e,
+                exc_info=DEBUG_TRACEBACKS,
             )
-            if expected_final_path and os.path.exists(expected_final_path):
-                os.remove(expected_final_path)
+            await asyncio.to_thread(shutil.rmtree, workdir, ignore_errors=True)
             return None
 
     # If we get here, all strategies failed
-    logger.error(f"All download strategies failed for {url}")
+    logger.error("All download strategies failed for %s", url)
+    await asyncio.to_thread(shutil.rmtree, workdir, ignore_errors=True)
+    return None
+
+
+def get_cached_audio(video_id: str) -> str | None:
+    """Return the cached MP3 for video_id, marking it as recently used, or None."""
+    cache_entry = AUDIO_CACHE_DIR / video_id
+    for cached_path in cache_entry.glob("*.mp3"):
+        # The entry directory's mtime is the LRU timestamp used for eviction
+        os.utime(cache_entry)
+        return str(cached_path)
     return None
 
 
-def download_youtube_video(url: str, video_id: str, quality: int, progress_hooks: list = None) -> str | None:
+def store_audio_in_cache(video_id: str, file_path: str, in_use: frozenset[str] = frozenset()) -> str:
+    """
+    Move a converted MP3 into the audio cache and return its new path.
+    Entries of the video_ids in in_use are kept when making room.
+    """
+    cache_entry = AUDIO_CACHE_DIR / video_id
+    cache_entry.mkdir(parents=True, exist_ok=True)
+    cached_path = cache_entry / os.path.basename(file_path)
+    shutil.move(file_path, cached_path)
+    # The file is in the cache now; failing to make room must not fail the store
+    try:
+        evict_audio_cache(keep=cache_entry, in_use=in_use)
+    except OSError as e:
+        logger.warning("Could not evict from the audio cache: %s", e)
+    return str(cached_path)
+
+
+def get_audio_cache_entries_in_use() -> frozenset[str]:
+    """
+    Return the video_ids whose cache entries are being downloaded or sent
+    right now. Call on the event loop, which owns both dicts.
+    """
+    in_use = {
+        video_id for video_id, lock in audio_download_locks.items() if lock.locked()
+    }
+    for operation in active_operations.values():
+        file_path = operation.get("file_path")
+        if file_path and Path(file_path).is_relative_to(AUDIO_CACHE_DIR):
+            in_use.add(Path(file_path).parent.name)
+    return frozenset(in_use)
+
+
+def evict_audio_cache(keep: Path, in_use: frozenset[str] = frozenset()) -> None:
+    """
+    Remove least recently used cache entries until under AUDIO_CACHE_MAX_BYTES,
+    skipping keep and the entries of the video_ids in in_use.
+    """
+    with audio_cache_eviction_lock:
+        entries = []
+        total_size = 0
+        for cache_entry in AUDIO_CACHE_DIR.iterdir():
+            try:
+                entry_size = sum(f.stat().st_size for f in cache_entry.glob("*.mp3"))
+                entries.append((cache_entry.stat().st_mtime, entry_size, cache_entry))
+            except FileNotFoundError:
+                # Removed while being listed
+                continue
+            total_size += entry_size
+
+        for _, entry_size, cache_entry in sorted(entries):
+            if total_size <= AUDIO_CACHE_MAX_BYTES:
+                break
+            if cache_entry == keep or cache_entry.name in in_use:
+                continue
+            shutil.rmtree(cache_entry, ignore_errors=True)
+            total_size -= entry_size
+            logger.info(f"Evicted cached audio: {cache_entry.name}")
+
+
+async def get_audio_file(url: str, video_id: str) -> str | None:
+    """
+    Return an MP3 for the video, from the audio cache when it was converted before.
+
+    Fresh downloads are moved into the cache, so the returned file must not
+    be deleted by the caller unless it lies outside AUDIO_CACHE_DIR.
+
+    Raises:
+        YouTubeError: When YouTube returns a user-facing error (geo-restriction, etc.)
+    """
+    async with audio_download_locks.setdefault(video_id, asyncio.Lock()):
+        # Cache lookups, moves and evictions touch the disk, so keep them
+        # off the event loop
+        cached_path = await asyncio.to_thread(get_cached_audio, video_id)
+        if cached_path:
+            logger.info(f"Using cached audio for {video_id}: {cached_path}")
+            return cached_path
+
+        audio_file_path = await download_and_convert_youtube(url, video_id)
+        if not audio_file_path:
+            return None
+
+        try:
+            cached_path = await asyncio.to_thread(
+                store_audio_in_cache, video_id, audio_file_path,
+                get_audio_cache_entries_in_use(),
+            )
+        except OSError as e:
+            # Only creating the entry or the move can fail here, so the MP3
+            # is still in its work directory
+            logger.warning(f"Could not cache audio for {video_id}: {e}")
+            return audio_file_path
+        await asyncio.to_thread(
+            shutil.rmtree, os.path.dirname(audio_file_path), ignore_errors=True
+        )
+        return cached_path
+
+
+# Options shared by every video download; outtmpl, format and progress
+# hooks are per call
+VIDEO_BASE_YDL_OPTS = {
+    "merge_output_format": "mp4",
+    # Stream-copy remux (-c copy) for single-file fallbacks that aren't
+    # MP4 yet; merged downloads are already MP4 and skip it
+    "postprocessors": [
+        {
+            "key": "FFmpegVideoRemuxer",
+            "preferedformat": "mp4",
+        }
+    ],
+    # Put the moov atom at the start so Telegram can stream the video
+    "postprocessor_args": {
+        # yt-dlp looks these up by postprocessor key without "FFmpeg"
+        "merger": ["-movflags", "+faststart"],
+        "videoremuxer": ["-movflags", "+faststart"],
+    },
+    "noplaylist": True,
+    "logger": logger,
+    "verbose": YTDL_VERBOSE,
+    "quiet": not YTDL_VERBOSE,
+    "noprogress": True,
+    "ignoreerrors": False,
+    "http_headers": {
+        "User-Agent": (
+            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+            "AppleWebKit/537.36 (KHTML, like Gecko) "
+            "Chrome/120.0.0.0 Safari/537.36"
+        ),
+    },
+    "geo_bypass": True,
+    # Same parallel fragment / chunked download tuning as audio downloads
+    "concurrent_fragment_downloads": 8,
+    "http_chunk_size": 10 * 1024 * 1024,  # 10 MB
+    "retries": YTDL_RETRIES,
+    "fragment_retries": YTDL_RETRIES,
+    "retry_sleep_functions": YTDL_RETRY_SLEEP_FUNCTIONS,
+    "throttledratelimit": YTDL_THROTTLED_RATE_LIMIT,
+    "socket_timeout": 30,
+    "ffmpeg_location": FFMPEG_LOCATION,
+}
+
+
+def video_faststart_args_applied() -> bool:
+    """Return True if yt-dlp passes VIDEO_BASE_YDL_OPTS' faststart flags to FFmpeg."""
+    try:
+        with yt_dlp.YoutubeDL(
+            {"postprocessor_args": VIDEO_BASE_YDL_OPTS["postprocessor_args"]}
+        ) as ydl:
+            postprocessors = (FFmpegMergerPP(ydl), FFmpegVideoRemuxerPP(ydl, "mp4"))
+            # The keys yt-dlp uses for the (first) output file's arguments
+            return all(
+                "+faststart" in pp._configuration_args("ffmpeg", ["_o1", "_o", ""])
+                for pp in postprocessors
+            )
+    except Exception as e:
+        logger.debug("Could not check the FFmpeg postprocessor arguments: %s", e)
+        return False
+
+
+def download_youtube_video(
+    url: str,
+    video_id: str,
+    quality: int,
+    progress_hooks: list = None,
+    info: dict | None = None,
+) -> str | None:
     """
     Download a YouTube video at the specified quality.
 
@@ -1756,11 +2479,16 @@ def download_youtube_video(url: str, video_id: str, quality: int, progress_hooks
         video_id: Video ID for temp filename
         quality: Quality designation (e.g., 1440, 1080, 720) - NOT actual pixel height
         progress_hooks: Optional list of progress hook functions
+        info: Optional info dict from the quality probe; when given, the
+            download reuses its formats instead of extracting the video again
 
     Downloads video and audio separately and merges them using FFmpeg.
     Uses format_note filtering to get the correct quality regardless of aspect ratio.
     """
-    base_output_template = str(TEMP_DIR / f"{video_id}_video")
+    # Private work directory per request (see download_and_convert_youtube);
+    # the caller removes it once the video has been sent
+    workdir = tempfile.mkdtemp(prefix=f"{video_id}_{quality}p_", dir=TEMP_DIR)
+    base_output_template = os.path.join(workdir, f"{video_id}_video")
     expected_final_path = None
 
     # Use provided hooks or empty list
@@ -1773,6 +2501,9 @@ def download_youtube_video(url: str, video_id: str, quality: int, progress_hooks
     #
     # Prefer best quality (HDR if available) at the requested resolution
     format_string = (
+        # A pre-muxed MP4 at the requested quality (YouTube still serves
+        # one at 360p) needs no separate audio download or FFmpeg merge
+        f"best[format_note^={quality}p][ext=mp4]/"
         # Best video at requested quality + best audio
         f"bestvideo[format_note^={quality}p]+bestaudio/"
         # Height-based fallback
@@ -1781,29 +2512,10 @@ def download_youtube_video(url: str, video_id: str, quality: int, progress_hooks
     )
 
     ydl_opts = {
+        **VIDEO_BASE_YDL_OPTS,
         "outtmpl": base_output_template + ".%(ext)s",
         "format": format_string,
-        "merge_output_format": "mp4",
-        "postprocessors": [
-            {
-                "key": "FFmpegVideoConvertor",
-                "preferedformat": "mp4",
-            }
-        ],
-        "noplaylist": True,
-        "logger": logger,
-        "verbose": True,
-        "noprogress": True,
-        "ignoreerrors": False,
         "progress_hooks": hooks,
-        "http_headers": {
-            "User-Agent": (
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                "AppleWebKit/537.36 (KHTML, like Gecko) "
-                "Chrome/120.0.0.0 Safari/537.36"
-            ),
-        },
-        "geo_bypass": True,
     }
 
     try:
@@ -1811,21 +2523,39 @@ def download_youtube_video(url: str, video_id: str, quality: int, progress_hooks
         logger.info(f"Format string: {format_string}")
 
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
             if info:
+                # Same as --load-info-json: skips the webpage and player
+                # fetches. sanitize_info copies the dict, since
+                # process_ie_result modifies it and other qualities of the
+                # same video may be downloading from it concurrently.
+                try:
+                    info = ydl.process_ie_result(ydl.sanitize_info(info), download=True)
+                except (yt_dlp.utils.DownloadError, yt_dlp.utils.ReExtractInfo) as e:
+                    # The probe's format URLs may have expired, or the
+                    # download was throttled (which extract_info would
+                    # handle by extracting again): start over from scratch
+                    logger.info("Download from probe info failed for %s, extracting again: %s", url, e)
+                    remove_work_files(workdir, os.listdir(workdir))
+                    info = None
+            if not info:
+                info = ydl.extract_info(url, download=True)
+            # yt-dlp reports where the merged file actually ended up
+            if info and info.get("requested_downloads"):
                 video_title = info.get('title', video_id)
                 sanitized_title = sanitize_filename(video_title)
 
-                # Find the downloaded file
-                temp_file = f"{base_output_template}.mp4"
-                expected_final_path = str(TEMP_DIR / f"{sanitized_title}_{quality}p.mp4")
+                temp_file = info["requested_downloads"][0]["filepath"]
+                expected_final_path = os.path.join(workdir, f"{sanitized_title}_{quality}p.mp4")
 
-                if os.path.exists(temp_file):
-                    try:
-                        os.rename(temp_file, expected_final_path)
-                        logger.info(f"Renamed to: {expected_final_path}")
-                    except OSError:
-                        expected_final_path = temp_file
+                # A missing temp file shows up as FileNotFoundError (and
+                # fails the check below), no separate exists() check
+                try:
+                    os.rename(temp_file, expected_final_path)
+                    logger.info(f"Renamed to: {expected_final_path}")
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    expected_final_path = temp_file
 
                 if expected_final_path and os.path.exists(expected_final_path):
                     logger.info(f"Video download successful: {expected_final_path}")
@@ -1833,7 +2563,7 @@ def download_youtube_video(url: str, video_id: str, quality: int, progress_hooks
 
     except yt_dlp.utils.DownloadError as e:
         error_msg = str(e)
-        logger.error(f"Video download failed: {e}")
+        logger.error("Video download failed: %s", e)
         # Check if this is a YouTube error that should be shown to user
         if "ERROR: [youtube]" in error_msg:
             # Trim the error - only show first line (before country list or extra details)
@@ -1841,11 +2571,13 @@ def download_youtube_video(url: str, video_id: str, quality: int, progress_hooks
             # Also trim if there's "This video is available in" list
             if "This video is available in" in first_line:
                 first_line = first_line.split("This video is available in")[0].strip()
+            shutil.rmtree(workdir, ignore_errors=True)
             raise YouTubeError(first_line)
     except Exception as e:
-        logger.error(f"Error downloading video: {e}", exc_info=True)
+        logger.error("Error downloading video: %s", e, exc_info=True)
 
-    logger.error(f"Video download failed for {url}")
+    logger.error("Video download failed for %s", url)
+    shutil.rmtree(workdir, ignore_errors=True)
     return None
 
 
@@ -1858,12 +2590,14 @@ async def send_video_with_pyrogram(
     caption: str | None = None,
 ) -> bool:
     """Send a video file using Pyrogram, suitable for larger files."""
-    if not API_ID or not API_HASH:
-        logger.error("Pyrogram API_ID or API_HASH not configured.")
+    app = await get_pyrogram_app()
+    if app is None:
+        logger.error(
+            "Pyrogram client is not running (check API_ID and API_HASH). "
+            "Cannot send large file."
+        )
         return False
 
-    pyrogram_session_name = "pyrogram_bot_session_video"
-    
     progress_args_tuple = None
     if (
         processing_message_ptb
@@ -1879,31 +2613,18 @@ async def send_video_with_pyrogram(
         )
 
     try:
-        effective_api_id = int(API_ID)
-        
-        async with PyrogramClient(
-            name=pyrogram_session_name,
-            api_id=effective_api_id,
-            api_hash=API_HASH,
-            bot_token=TELEGRAM_BOT_TOKEN,
-            in_memory=True,
-        ) as app:
-            logger.info(f"Pyrogram sending video: {file_path} to {chat_id}")
-            await app.send_video(
-                chat_id=chat_id,
-                video=file_path,
-                caption=caption or "",
-                supports_streaming=True,
-                progress=pyrogram_upload_progress if progress_args_tuple else None,
-                progress_args=progress_args_tuple if progress_args_tuple else (),
-            )
-            logger.info(f"Pyrogram successfully sent video to {chat_id}")
-            if progress_args_tuple:
-                progress_message_last_edit_time.pop(
-                    (progress_args_tuple[0], progress_args_tuple[1]), None
-                )
-            return True
-            
+        logger.info(f"Pyrogram sending video: {file_path} to {chat_id}")
+        await app.send_video(
+            chat_id=chat_id,
+            video=file_path,
+            caption=caption or "",
+            supports_streaming=True,
+            progress=pyrogram_upload_progress if progress_args_tuple else None,
+            progress_args=progress_args_tuple if progress_args_tuple else (),
+        )
+        logger.info(f"Pyrogram successfully sent video to {chat_id}")
+        return True
+
     except FloodWait as e_flood:
         logger.error(f"Pyrogram FloodWait: Must wait {e_flood.value} seconds.")
         return False
@@ -1912,6 +2633,40 @@ async def send_video_with_pyrogram(
         return False
 
 
+class OrjsonHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest that decodes Bot API responses with orjson instead of json."""
+
+    @staticmethod
+    def parse_json_payload(payload: bytes) -> dict:
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            # Let PTB's stdlib decoder produce its usual error for bad payloads
+            return HTTPXRequest.parse_json_payload(payload)
+
+
+def build_bot_request(connection_pool_size: int) -> HTTPXRequest:
+    """Create the HTTP transport used for Bot API calls."""
+    return OrjsonHTTPXRequest(
+        connection_pool_size=connection_pool_size,
+        # HTTP/2 multiplexes concurrent edits/sends over one TLS connection
+        http_version="2",
+        connect_timeout=60,  # Added for general connection establishment
+        read_timeout=60,  # General read timeout for API calls
+        write_timeout=60,  # General write timeout for API calls
+        pool_timeout=10,  # Timeout for connections in the pool
+        # Keep idle connections open between bursts instead of httpx's 5s
+        # default, so the next send skips a fresh TCP + TLS handshake
+        httpx_kwargs={
+            "limits": httpx.Limits(
+                max_connections=connection_pool_size,
+                max_keepalive_connections=connection_pool_size,
+                keepalive_expiry=60.0,
+            ),
+        },
+    )
+
+
 def main() -> None:
     """Start the bot."""
     if not TELEGRAM_BOT_TOKEN:
@@ -1919,13 +2674,28 @@ def main() -> None:
             "TELEGRAM_BOT_TOKEN not found in .env file. Please add it."
         )
         return
-    if not API_ID or not API_HASH:  # Check for Pyrogram creds too
+    if not API_ID_INT or not API_HASH:  # Check for Pyrogram creds too
         logger.warning(
-            "API_ID and/or API_HASH not found in .env. Sending large files "
+            "API_ID and/or API_HASH missing or invalid in .env. Sending large files "
             "via Pyrogram will fail."
         )
         # Allow bot to start, but Pyrogram part will be disabled.
 
+    if "firefox_cookies" not in HOST_CAPABILITIES:
+        logger.info(
+            "No Firefox profile found. Skipping the Firefox cookies download "
+            "strategy."
+        )
+    else:
+        export_firefox_cookies()
+    if not FFMPEG_LOCATION:
+        logger.warning("FFmpeg not found in PATH. Audio conversion will fail.")
+    if not video_faststart_args_applied():
+        logger.warning(
+            "yt-dlp ignores the faststart arguments. Videos may not stream "
+            "before they are fully downloaded."
+        )
+
     # Initialize temp directory and run startup cleanup
     ensure_temp_dir()
     startup_files_removed = cleanup_old_temp_files()
@@ -1935,10 +2705,24 @@ def main() -> None:
     application = (
         ApplicationBuilder()
         .token(TELEGRAM_BOT_TOKEN)
-        .connect_timeout(60)  # Added for general connection establishment
-        .read_timeout(60)  # General read timeout for API calls
-        .write_timeout(60)  # General write timeout for API calls
-        .pool_timeout(60)  # Timeout for connections in the pool
+        # With HTTP/2 a small pool serves many concurrent API calls;
+        # polling keeps a single connection
+        .request(build_bot_request(connection_pool_size=64))
+        .get_updates_request(build_bot_request(connection_pool_size=1))
+        # Handle a bounded number of updates concurrently instead of strictly
+        # one after another (or unbounded)
+        .concurrent_updates(MAX_CONCURRENT_UPDATES)
+        # Queue outgoing API calls under Telegram's flood limits and retry
+        # RetryAfter errors instead of failing the request
+        .rate_limiter(
+            AIORateLimiter(
+                overall_max_rate=30,
+                overall_time_period=1,
+                group_max_rate=20,
+                group_time_period=60,
+                max_retries=5,
+            )
+        )
         .build()
     )
 
@@ -1948,18 +2732,38 @@ def main() -> None:
     )
     application.add_handler(CallbackQueryHandler(button_callback_handler))
 
-    # Start periodic cleanup task
+    # Start periodic cleanup task and the shared Pyrogram client
     async def post_init(app):
         asyncio.create_task(periodic_cleanup_task())
         logger.info("Started periodic cleanup task")
-    
+        await get_pyrogram_app()
+
+    async def post_shutdown(app):
+        await stop_pyrogram_client()
+        download_executor.shutdown(wait=False, cancel_futures=True)
+        probe_executor.shutdown(wait=False, cancel_futures=True)
+
     application.post_init = post_init
+    application.post_shutdown = post_shutdown
 
     logger.info(
-        "Starting bot with Pyrogram integration for large files & DEBUG "
-        "logging..."
+        "Starting bot with Pyrogram integration for large files..."
     )
-    application.run_polling()
+    # Drop updates queued while the bot was down so a restart doesn't start
+    # a burst of downloads for stale requests
+    if WEBHOOK_URL:
+        # Telegram pushes updates as they happen instead of the bot asking
+        # for them; the token in the path keeps the endpoint unguessable
+        logger.info(f"Receiving updates via webhook on port {WEBHOOK_PORT}")
+        application.run_webhook(
+            listen="0.0.0.0",
+            port=WEBHOOK_PORT,
+            url_path=TELEGRAM_BOT_TOKEN,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{TELEGRAM_BOT_TOKEN}",
+            drop_pending_updates=True,
+        )
+    else:
+        application.run_polling(drop_pending_updates=True)
     logger.info("Bot stopped.")
 
 